@@ -0,0 +1,90 @@
+# autograder_batch.py
+# Bulk grading for whole class sets.
+# PDF/DOCX extraction runs on the extraction worker pool (extraction_pool.py),
+# model calls run with bounded concurrency, and results are yielded as soon
+# as each submission finishes. Submissions are pulled from the iterable only
+# as slots free up, so a generator over a class set is never held in memory
+# all at once. One bad submission never aborts the batch.
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from autograder_simplified import autograde_text, extract_text, extraction_error_result, file_kind
+from extraction import is_extraction_error
+
+# (submission_id, file_bytes, filename)
+Submission = Tuple[Any, bytes, str]
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("AUTOGRADER_BATCH_CONCURRENCY", "16"))
+
+
+def _error_result(submission_id, filename, error: Exception) -> Dict[str, Any]:
+    return {
+        "id": submission_id,
+        "filename": filename,
+        "detected_type": "error",
+        "feedback": f"⚠️ Grading failed: {error}",
+        "grade": None,
+        "tokens": 0,
+        "cost": 0.0,
+        "error": f"{type(error).__name__}: {error}"
+    }
+
+
+def autograde_batch(
+    submissions: Iterable[Submission],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    on_progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None,
+    user_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Grade many submissions, yielding each result as it completes (not in input order).
+
+    Args:
+        submissions: iterable of (id, file_bytes, filename), consumed lazily
+            (at most 2 x max_concurrency submissions are held at a time)
+        max_concurrency: max model calls in flight
+        on_progress: called as on_progress(done, total, result) after each item;
+            total is None when submissions has no len()
+        user_id: Optional user to reserve/charge tokens against
+
+    Yields:
+        autograde_file-style result dicts plus "id" and "filename". Failed items
+        get detected_type "error" and an "error" message instead of raising.
+    """
+    total = len(submissions) if hasattr(submissions, "__len__") else None
+    submissions = iter(submissions)
+    # one queued behind every running item keeps the workers busy
+    window = 2 * max_concurrency
+
+    grade_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="autograde-batch")
+
+    def grade_one(submission: Submission) -> Dict[str, Any]:
+        submission_id, file_bytes, filename = submission
+        try:
+            text = extract_text(file_bytes, file_kind(filename))
+            if is_extraction_error(text):
+                # unreadable file: a per-item error, not a submission to grade
+                return {"id": submission_id, "filename": filename, **extraction_error_result(text), "error": text}
+            result = autograde_text(text, user_id=user_id)
+        except Exception as e:
+            return _error_result(submission_id, filename, e)
+        return {"id": submission_id, "filename": filename, **result}
+
+    try:
+        pending = {grade_pool.submit(grade_one, s) for s in islice(submissions, window)}
+        done = 0
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending |= {grade_pool.submit(grade_one, s) for s in islice(submissions, len(finished))}
+            for future in finished:
+                result = future.result()
+                done += 1
+                if on_progress:
+                    on_progress(done, total, result)
+                yield result
+    finally:
+        # If the caller stops iterating early, drop whatever hasn't started
+        grade_pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,194 @@
+# batch_api.py
+# Offline grading through the OpenAI Batch API.
+#
+#   1. prepare: turn submissions into Batch-format JSONL request lines
+#      (same prompt and parameters as generate_ai_feedback)
+#   2. submit the file (submit_batch) and collect the output file later
+#      (download_batch_results), or use the OpenAI dashboard
+#   3. ingest: parse the output JSONL, extract grades and record tokens/cost
+#      for every line through TokenManager in one bulk write
+#
+# CLI:
+#   python batch_api.py prepare <submissions_dir> <requests.jsonl>
+#   python batch_api.py ingest <results.jsonl> [--user USER_ID]
+
+import argparse
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from autograder_simplified import (
+    MAX_COMPLETION_TOKENS, MODEL_NAME, build_messages, completion_cost,
+    detect_content_type, extract_text, file_kind, parse_grade,
+)
+from token_manager import TokenManager
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch API requests are billed at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+
+
+def build_batch_request(custom_id: str, text: str, content_type: Optional[str] = None, model: str = MODEL_NAME) -> Dict[str, Any]:
+    """One Batch API request line for a submission."""
+    detected_type = content_type or detect_content_type(text)
+    return {
+        "custom_id": str(custom_id),
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": build_messages(detected_type, text),
+            "temperature": 0.1,
+            "max_tokens": MAX_COMPLETION_TOKENS
+        }
+    }
+
+
+def write_batch_requests(submissions: Iterable[Tuple], path: str, model: str = MODEL_NAME) -> int:
+    """
+    Write Batch API request JSONL.
+
+    Args:
+        submissions: iterable of (custom_id, text) or (custom_id, text, content_type)
+        path: output .jsonl path
+
+    Returns: number of request lines written
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for submission in submissions:
+            custom_id, text = submission[0], submission[1]
+            content_type = submission[2] if len(submission) > 2 else None
+            f.write(json.dumps(build_batch_request(custom_id, text, content_type, model), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def parse_batch_result(line: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn one Batch API output line into a grading result.
+    Returns: {"custom_id", "model", "feedback", "grade", "tokens", "cost"}
+    """
+    custom_id = line.get("custom_id")
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    error = line.get("error") or body.get("error")
+    if error or response.get("status_code", 200) != 200 or not body.get("choices"):
+        message = error.get("message") if isinstance(error, dict) else error
+        return {
+            "custom_id": custom_id,
+            "model": body.get("model", MODEL_NAME),
+            "feedback": f"⚠️ AI feedback failed: {message or 'status ' + str(response.get('status_code'))}",
+            "grade": None,
+            "tokens": 0,
+            "cost": 0.0
+        }
+
+    feedback_text = body["choices"][0]["message"]["content"]
+    usage = body.get("usage") or {}
+    cost = completion_cost(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                           body.get("model", MODEL_NAME)) * BATCH_PRICE_FACTOR
+    return {
+        "custom_id": custom_id,
+        "model": body.get("model", MODEL_NAME),
+        "feedback": feedback_text,
+        "grade": parse_grade(feedback_text),
+        "tokens": usage.get("total_tokens", 0),
+        "cost": round(cost, 6)
+    }
+
+
+def read_batch_results(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream parsed results from a Batch API output JSONL file."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield parse_batch_result(json.loads(line))
+
+
+def ingest_batch_results(
+    path: str,
+    user_id: Optional[str] = None,
+    user_ids: Optional[Dict[str, str]] = None,
+    task: str = "autograde_batch",
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse a Batch API output file and record usage for every graded line.
+
+    Args:
+        path: output .jsonl from the Batch API
+        user_id: user charged for every line (e.g. the instructor)
+        user_ids: optional custom_id -> user_id mapping, overrides user_id
+
+    Returns: {custom_id: result}
+    """
+    results = {}
+    usage = []
+    for result in read_batch_results(path):
+        results[result["custom_id"]] = result
+        owner = (user_ids or {}).get(result["custom_id"], user_id)
+        if owner and result["tokens"]:
+            usage.append({
+                "user_id": owner,
+                "tokens": result["tokens"],
+                "cost": result["cost"],
+                "model": result["model"],
+                "task": task
+            })
+    if usage:
+        TokenManager.record_usage_bulk(usage)
+    return results
+
+
+def submit_batch(requests_path: str, completion_window: str = "24h"):
+    """Upload a request file and start a batch. Returns the Batch object."""
+    from autograder_simplified import get_client
+    client = get_client()
+    with open(requests_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    return client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=completion_window
+    )
+
+
+def download_batch_results(batch_id: str, path: str) -> Optional[str]:
+    """Save a finished batch's output file to `path`. Returns None if not finished yet."""
+    from autograder_simplified import get_client
+    client = get_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        return None
+    with open(path, "wb") as f:
+        f.write(client.files.content(batch.output_file_id).read())
+    return path
+
+
+def _submissions_from_dir(directory: str) -> Iterator[Tuple[str, str]]:
+    for name in sorted(os.listdir(directory)):
+        full = os.path.join(directory, name)
+        if os.path.isfile(full):
+            with open(full, "rb") as f:
+                yield name, extract_text(f.read(), file_kind(name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline grading via the OpenAI Batch API")
+    sub = parser.add_subparsers(dest="command", required=True)
+    prepare = sub.add_parser("prepare", help="build request JSONL from a directory of submissions")
+    prepare.add_argument("directory")
+    prepare.add_argument("output")
+    ingest = sub.add_parser("ingest", help="parse result JSONL and record usage")
+    ingest.add_argument("results")
+    ingest.add_argument("--user", default=None, help="user charged for the tokens")
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        n = write_batch_requests(_submissions_from_dir(args.directory), args.output)
+        print(f"✅ Wrote {n} batch requests to {args.output}")
+    else:
+        graded = ingest_batch_results(args.results, user_id=args.user)
+        for custom_id, result in graded.items():
+            print(f"{custom_id}: {result['grade']}/100 ({result['tokens']} tokens, ${result['cost']})")
+        print(f"✅ Ingested {len(graded)} results")
@@ -0,0 +1,89 @@
+# benchmarks/bench_content_type.py
+# Compare the single-pass content-type classifier with the previous
+# keyword-scan heuristic: latency on large submissions, batch throughput on
+# small ones, and accuracy on fixtures/content_type_cases.jsonl.
+#
+#   python benchmarks/bench_content_type.py [--megabytes 4] [--batch 20000] [--repeat 3]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_type import classify, classify_batch
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "fixtures", "content_type_cases.jsonl")
+
+
+def legacy_detect_content_type(text: str) -> str:
+    """The keyword-scan heuristic the classifier replaced, kept for comparison."""
+    if not text or not text.strip():
+        return "text"
+    code_keywords = [
+        "def ", "class ", "import ", "print(", "if ", "for ", "while ",
+        "function", "const ", "let ", "var ", "public ", "private ",
+        "return ", "void ", "#include"
+    ]
+    if any(k in text for k in code_keywords):
+        return "code"
+    math_indicators = ["=", "∫", "∑", "√", "π", "sin", "cos", "tan", "log", "lim", "dx", "dy"]
+    if any(m in text for m in math_indicators):
+        if text.count("=") > 2 or any(m in text for m in ["∫", "∑", "√", "π", "lim"]):
+            return "math"
+    return "text"
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+def _accuracy(detect) -> float:
+    with open(FIXTURES, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    return round(sum(detect(c["text"]) == c["expected"] for c in cases) / len(cases), 3)
+
+
+def run(megabytes: float = 4, batch: int = 20000, repeat: int = 3) -> dict:
+    # Worst case for the keyword scan: long prose with no keyword at all
+    sentence = "The committee reviewed the proposal and agreed to meet again. "
+    large = sentence * int(megabytes * 2**20 / len(sentence))
+    small = ["The quick brown fox jumps over the lazy dog. " * 4,
+             "def f(x):\n    return x * 2\n",
+             "∫(2x + 3)dx = x² + 3x + C"] * (batch // 3)
+
+    legacy_large = _best(lambda: legacy_detect_content_type(large), repeat)
+    classify_large = _best(lambda: classify(large), repeat)
+    legacy_batch = _best(lambda: [legacy_detect_content_type(t) for t in small], repeat)
+    classify_batch_s = _best(lambda: classify_batch(small), repeat)
+    return {
+        "benchmark": "content_type",
+        "large_chars": len(large),
+        "large_ms": {"legacy": round(legacy_large * 1000, 3), "classifier": round(classify_large * 1000, 3)},
+        "batch_items": len(small),
+        "batch_per_second": {
+            "legacy": round(len(small) / legacy_batch) if legacy_batch else None,
+            "classifier": round(len(small) / classify_batch_s) if classify_batch_s else None,
+        },
+        "accuracy": {
+            "legacy": _accuracy(legacy_detect_content_type),
+            "classifier": _accuracy(lambda t: classify(t)["content_type"]),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-type classifier vs keyword heuristic")
+    parser.add_argument("--megabytes", type=float, default=4)
+    parser.add_argument("--batch", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.megabytes, args.batch, args.repeat), indent=2))
@@ -0,0 +1,71 @@
+# benchmarks/bench_docx_extraction.py
+# Compare the streaming document.xml extractor with python-docx on large
+# generated documents.
+#
+#   python benchmarks/bench_docx_extraction.py [--paragraphs 20000] [--tables 200] [--repeat 3]
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx import Document
+
+from extraction import _extract_docx_with_python_docx, iter_docx_blocks
+
+
+def make_docx(paragraphs: int, tables: int) -> bytes:
+    doc = Document()
+    every = max(1, paragraphs // max(1, tables))
+    for i in range(paragraphs):
+        doc.add_paragraph(f"Paragraph {i}: the student discusses results, methods and limitations in detail.")
+        if tables and i % every == 0:
+            table = doc.add_table(rows=4, cols=3)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"r{r}c{c}"
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def _measure(fn, data: bytes, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        text = fn(data)
+        best = min(best, time.perf_counter() - began)
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(best, 4), "peak_mb": round(peak / 2**20, 2), "chars": len(text)}
+
+
+def run(paragraphs: int = 20000, tables: int = 200, repeat: int = 3) -> dict:
+    data = make_docx(paragraphs, tables)
+    streaming = _measure(lambda b: "\n".join(iter_docx_blocks(b)), data, repeat)
+    python_docx = _measure(_extract_docx_with_python_docx, data, repeat)
+    return {
+        "benchmark": "docx_extraction",
+        "paragraphs": paragraphs,
+        "tables": tables,
+        "docx_bytes": len(data),
+        "streaming": streaming,
+        "python_docx": python_docx,
+        "speedup": round(python_docx["seconds"] / streaming["seconds"], 2) if streaming["seconds"] else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming vs python-docx DOCX extraction")
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.paragraphs, args.tables, args.repeat), indent=2))
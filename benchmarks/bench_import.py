@@ -0,0 +1,61 @@
+# benchmarks/bench_import.py
+# Import time of the project's modules, each in a fresh interpreter, and which
+# heavy third-party packages the import drags in (they should load lazily).
+#
+#   python benchmarks/bench_import.py [--repeat 5] [--modules content_type,storage,autograder_simplified]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("content_type", "storage", "token_manager", "extraction", "autograder_simplified", "main")
+HEAVY = ("fitz", "docx", "openai", "httpx", "tiktoken", "fastapi")
+
+_PROBE = """
+import json, sys, time
+began = time.perf_counter()
+try:
+    import {module}
+    error = None
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+seconds = time.perf_counter() - began
+print(json.dumps({{"seconds": seconds, "error": error,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int = 5) -> dict:
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY)],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+        # anything printed besides the probe line is an import side effect
+        sample["printed"] = len(proc.stdout.strip().splitlines()) > 1
+        if best is None or sample["seconds"] < best["seconds"]:
+            best = sample
+    best["ms"] = round(best.pop("seconds") * 1000, 2)
+    return best
+
+
+def run(modules=MODULES, repeat: int = 5) -> dict:
+    return {
+        "benchmark": "import_time",
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "modules": {module: measure(module, repeat) for module in modules},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold import time per module")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modules", default=",".join(MODULES))
+    args = parser.parse_args()
+    print(json.dumps(run(args.modules.split(","), args.repeat), indent=2))
@@ -0,0 +1,318 @@
+# benchmarks/bench_load.py
+# Offline load-test suite. Nothing leaves the machine: model calls go to a
+# local fake OpenAI server (fake_openai.py) and submissions are generated
+# (corpus.py).
+#
+#   extraction   PDF / DOCX / code throughput, in-process and on the worker pool
+#   storage      record_usage ops/sec per backend as the usage log grows
+#   end_to_end   grades/sec and p50/p99 latency at several concurrency levels,
+#                sync (threads) and async
+#
+# Prints one JSON document; --output saves it and --compare diffs it against
+# an earlier run (current / baseline for every number).
+#
+#   python benchmarks/bench_load.py [--quick] [--latency 0.2] [--jitter 0.05] [--error-rate 0]
+#                                   [--concurrency 1,8,32,128]
+#                                   [--sections extraction,storage,end_to_end]
+#                                   [--output run.json] [--compare baseline.json]
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+from fake_openai import FakeOpenAIServer
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def _latency_stats(latencies: List[float], wall: float) -> Dict[str, Any]:
+    return {
+        "count": len(latencies),
+        "seconds": round(wall, 4),
+        "per_second": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+# ============================================================================
+# EXTRACTION
+# ============================================================================
+
+def bench_extraction(documents: int = 20, pdf_pages: int = 10, docx_paragraphs: int = 300,
+                     code_functions: int = 400) -> Dict[str, Any]:
+    from autograder_simplified import extract_text
+    from extraction import extract_document
+    from extraction_pool import extraction_service
+
+    corpora = {
+        "pdf": [corpus.pdf(pdf_pages, seed) for seed in range(documents)],
+        "docx": [corpus.docx(docx_paragraphs, seed) for seed in range(documents)],
+        "text": [corpus.code(code_functions, seed).encode("utf-8") for seed in range(documents)],
+    }
+    service = extraction_service()
+    service.start()
+    results = {}
+    for kind, files in corpora.items():
+        total_bytes = sum(len(f) for f in files)
+        entry = {"documents": len(files), "megabytes": round(total_bytes / 2**20, 3)}
+        modes = {"in_process": lambda f: extract_text(f, kind) if kind == "text" else extract_document(f, kind)}
+        if kind != "text":
+            modes["pool"] = None
+        for mode, extract in modes.items():
+            began = time.perf_counter()
+            if mode == "pool":
+                futures = [service.submit_extract(f, kind) for f in files]
+                chars = sum(len(f.result()) for f in futures)
+            else:
+                chars = sum(len(extract(f)) for f in files)
+            wall = time.perf_counter() - began
+            entry[mode] = {
+                "seconds": round(wall, 4),
+                "documents_per_second": round(len(files) / wall, 2),
+                "megabytes_per_second": round(total_bytes / 2**20 / wall, 2),
+                "chars": chars,
+            }
+        results[kind] = entry
+    results["pool_workers"] = service.workers
+    return results
+
+
+# ============================================================================
+# STORAGE
+# ============================================================================
+
+def bench_storage(rows: int = 20000, window: int = 2000, users: int = 50,
+                  backends=("json", "sqlite")) -> Dict[str, Any]:
+    import storage
+
+    results = {}
+    for backend in backends:
+        directory = tempfile.mkdtemp(prefix=f"bench-storage-{backend}-")
+        storage.open_db(os.path.join(directory, "tokens.json"), backend=backend)
+        for u in range(users):
+            storage.ensure_user(f"user{u}", token_limit=10**12)
+        windows = []
+        written = 0
+        while written < rows:
+            batch = min(window, rows - written)
+            began = time.perf_counter()
+            for i in range(batch):
+                storage.record_usage(f"user{(written + i) % users}", "autograde", "gpt-4o", 500, 0.004)
+            wall = time.perf_counter() - began
+            written += batch
+            windows.append({"rows": written, "ops_per_second": round(batch / wall, 1)})
+
+        began = time.perf_counter()
+        for u in range(users):
+            hold = storage.reserve_tokens(f"user{u}", 1000)
+            if hold is not None:
+                storage.release_tokens(f"user{u}", hold)
+        reserve_wall = time.perf_counter() - began
+        began = time.perf_counter()
+        read = sum(len(storage.get_logs_page(f"user{u}", limit=100)["logs"]) for u in range(users))
+        read_wall = time.perf_counter() - began
+
+        files = [os.path.join(directory, name) for name in os.listdir(directory)]
+        results[backend] = {
+            "record_usage": windows,
+            "reserve_release_per_second": round(users / reserve_wall, 1),
+            "log_page_reads_per_second": round(users / read_wall, 1),
+            "rows_read": read,
+            "disk_megabytes": round(sum(os.path.getsize(f) for f in files if os.path.isfile(f)) / 2**20, 3),
+        }
+    return results
+
+
+# ============================================================================
+# END TO END
+# ============================================================================
+
+def _setup_grading(base_url: str):
+    """Point the autograder at the fake server with fresh, empty storage and no cache."""
+    import autograder_simplified
+    import storage
+    from grading_cache import grading_cache
+    from http_transport import make_http_client
+    from openai import OpenAI
+
+    autograder_simplified.OPENAI_API_KEY = "sk-bench"
+    autograder_simplified.client = OpenAI(api_key="sk-bench", base_url=base_url,
+                                          http_client=make_http_client(), max_retries=0)
+    grading_cache().enabled = False
+    storage.open_db(os.path.join(tempfile.mkdtemp(prefix="bench-e2e-"), "tokens.json"))
+    storage.ensure_user("bench", token_limit=10**12)
+
+
+def _run_sync(texts: List[str], concurrency: int, user_id: str):
+    from autograder_simplified import autograde_text
+
+    def grade(text):
+        began = time.perf_counter()
+        result = autograde_text(text, "text", user_id=user_id)
+        return time.perf_counter() - began, result["grade"] is not None
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(grade, texts))
+    return outcomes, time.perf_counter() - began
+
+
+async def _run_async(texts: List[str], concurrency: int, user_id: str, base_url: str):
+    import autograder_simplified
+    from http_transport import make_async_http_client
+    from openai import AsyncOpenAI
+
+    # an AsyncClient belongs to one event loop
+    autograder_simplified.async_client = AsyncOpenAI(api_key="sk-bench", base_url=base_url,
+                                                     http_client=make_async_http_client(), max_retries=0)
+    autograder_simplified.set_max_concurrency(concurrency)
+
+    # at most `concurrency` gradings in flight, like the sync thread pool
+    slots = asyncio.Semaphore(concurrency)
+
+    async def grade(text):
+        async with slots:
+            began = time.perf_counter()
+            result = await autograder_simplified.autograde_text_async(text, "text", user_id=user_id)
+            return time.perf_counter() - began, result["grade"] is not None
+
+    began = time.perf_counter()
+    outcomes = await asyncio.gather(*(grade(t) for t in texts))
+    wall = time.perf_counter() - began
+    await autograder_simplified.async_client.close()
+    return outcomes, wall
+
+
+def bench_end_to_end(concurrency=(1, 8, 32, 128), requests_per_level: int = 200, latency: float = 0.2,
+                     jitter: float = 0.05, error_rate: float = 0.0, words: int = 300,
+                     modes=("sync", "async")) -> Dict[str, Any]:
+    from grading_cache import grading_cache
+    from http_transport import transport_metrics
+
+    cache_enabled = grading_cache().enabled
+    results = {"latency_s": latency, "jitter_s": jitter, "error_rate": error_rate, "levels": []}
+    with FakeOpenAIServer(latency=latency, jitter=jitter, error_rate=error_rate) as server:
+        _setup_grading(server.base_url)
+        try:
+            for level in concurrency:
+                # at least a few waves per level, so the pool is warm and busy
+                count = max(requests_per_level, level * 3)
+                for mode in modes:
+                    texts = corpus.essays(count, words, seed=level * 2 + (mode == "async"))
+                    retries_before = transport_metrics.retries
+                    if mode == "sync":
+                        outcomes, wall = _run_sync(texts, level, "bench")
+                    else:
+                        outcomes, wall = asyncio.run(_run_async(texts, level, "bench", server.base_url))
+                    entry = {"mode": mode, "concurrency": level,
+                             **_latency_stats([seconds for seconds, _ in outcomes], wall)}
+                    entry["grades_per_second"] = entry.pop("per_second")
+                    entry["failed"] = sum(1 for _, ok in outcomes if not ok)
+                    entry["retries"] = transport_metrics.retries - retries_before
+                    results["levels"].append(entry)
+            results["server_requests"] = server.requests
+            results["server_errors"] = server.errors
+        finally:
+            grading_cache().enabled = cache_enabled
+    return results
+
+
+# ============================================================================
+# COMPARISON
+# ============================================================================
+
+def _numbers(value, path=""):
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield path, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _numbers(item, f"{path}.{key}" if path else key)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            # key list entries by their identity fields when they have them
+            label = ",".join(f"{k}={item[k]}" for k in ("mode", "concurrency", "rows") if isinstance(item, dict) and k in item)
+            yield from _numbers(item, f"{path}[{label or i}]")
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Every number in both runs: {path: {"baseline", "current", "ratio"}}."""
+    before = dict(_numbers(baseline))
+    diff = {}
+    for path, value in _numbers(current):
+        if path in before and path != "meta.timestamp":
+            old = before[path]
+            diff[path] = {"baseline": old, "current": value,
+                          "ratio": round(value / old, 3) if old else None}
+    return diff
+
+
+def run(sections=("extraction", "storage", "end_to_end"), quick: bool = False,
+        concurrency=(1, 8, 32, 128), latency: float = 0.2, jitter: float = 0.05,
+        error_rate: float = 0.0) -> Dict[str, Any]:
+    report = {
+        "benchmark": "load",
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+        },
+    }
+    if "extraction" in sections:
+        report["extraction"] = bench_extraction(documents=4 if quick else 20)
+    if "storage" in sections:
+        report["storage"] = bench_storage(rows=2000 if quick else 20000, window=500 if quick else 2000)
+    if "end_to_end" in sections:
+        report["end_to_end"] = bench_end_to_end(concurrency, requests_per_level=40 if quick else 200,
+                                                latency=latency, jitter=jitter, error_rate=error_rate)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test against a fake OpenAI server")
+    parser.add_argument("--sections", default="extraction,storage,end_to_end")
+    parser.add_argument("--quick", action="store_true", help="small corpora, for a smoke run")
+    parser.add_argument("--concurrency", default="1,8,32,128")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="latency varies by up to ± this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="baseline report to diff against")
+    args = parser.parse_args()
+
+    report = run(
+        sections=args.sections.split(","),
+        quick=args.quick,
+        concurrency=[int(c) for c in args.concurrency.split(",")],
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report = {"benchmark": "load_comparison", "changes": compare(json.load(f), report)}
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,115 @@
+# benchmarks/bench_near_duplicates.py
+# Near-duplicate index at class-archive scale: indexing rate, query latency
+# as the index grows (LSH lookup vs a linear scan of every signature),
+# recall on planted near duplicates (a few words edited) and false matches
+# on fresh submissions.
+#
+#   python benchmarks/bench_near_duplicates.py [--submissions 200000] [--checkpoints 1000,10000,100000,200000]
+#                                              [--queries 200] [--edits 3] [--disk]
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+from near_duplicates import NearDuplicateIndex, similarity
+
+
+def _edited(text: str, edits: int, seed: int) -> str:
+    rng = random.Random(seed)
+    words = text.split(" ")
+    for _ in range(edits):
+        words[rng.randrange(len(words))] = rng.choice(["however", "clearly", "notably", "overall"])
+    return " ".join(words)
+
+
+def _percentile_ms(values, q):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))] * 1000, 3)
+
+
+def _linear_scan(index: NearDuplicateIndex, text: str, threshold: float):
+    # What a lookup costs without LSH: compare against every stored signature
+    signature = index.signature(text, "text")
+    best = None
+    for key, blob in index._db.execute("SELECT key, signature FROM submissions"):
+        score = similarity(signature, array("I", blob))
+        if score >= threshold and (best is None or score > best[1]):
+            best = (key, score)
+    return best
+
+
+def run(submissions: int = 200000, checkpoints=(1000, 10000, 100000, 200000), queries: int = 200,
+        edits: int = 3, words: int = 250, disk: bool = False):
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-neardup-"), "near_duplicates.db") if disk else ":memory:"
+    index = NearDuplicateIndex(path)
+    checkpoints = sorted(c for c in checkpoints if c <= submissions) or [submissions]
+    levels = []
+    added = 0
+    add_seconds = 0.0
+    for checkpoint in checkpoints:
+        began = time.perf_counter()
+        while added < checkpoint:
+            index.add(f"sub-{added}", corpus.essay(words, added), "text", {"feedback": "ok", "grade": 70})
+            added += 1
+        add_seconds += time.perf_counter() - began
+
+        rng = random.Random(checkpoint)
+        planted = [rng.randrange(added) for _ in range(queries)]
+        found = 0
+        lookups = []
+        for i, original in enumerate(planted):
+            text = _edited(corpus.essay(words, original), edits, i)
+            began = time.perf_counter()
+            match = index.query(text, "text")
+            lookups.append(time.perf_counter() - began)
+            found += bool(match and match.key == f"sub-{original}")
+        false_matches = sum(1 for i in range(queries)
+                            if index.query(corpus.essay(words, 10**9 + checkpoint * queries + i), "text"))
+        scans = []
+        for original in planted[:5]:
+            text = _edited(corpus.essay(words, original), edits, original)
+            began = time.perf_counter()
+            _linear_scan(index, text, index.threshold)
+            scans.append(time.perf_counter() - began)
+        levels.append({
+            "indexed": added,
+            "adds_per_second": round(added / add_seconds, 1),
+            "query_p50_ms": _percentile_ms(lookups, 50),
+            "query_p99_ms": _percentile_ms(lookups, 99),
+            "linear_scan_ms": round(sum(scans) / len(scans) * 1000, 3),
+            "recall": round(found / queries, 4),
+            "false_match_rate": round(false_matches / queries, 4),
+        })
+    report = {
+        "benchmark": "near_duplicates",
+        "words_per_submission": words,
+        "edits_per_near_duplicate": edits,
+        "threshold": index.threshold,
+        "levels": levels,
+    }
+    if disk:
+        index.close()
+        report["disk_megabytes"] = round(sum(os.path.getsize(os.path.join(os.path.dirname(path), f))
+                                             for f in os.listdir(os.path.dirname(path))) / 2**20, 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MinHash/LSH near-duplicate index at scale")
+    parser.add_argument("--submissions", type=int, default=200000)
+    parser.add_argument("--checkpoints", default="1000,10000,100000,200000")
+    parser.add_argument("--queries", type=int, default=200, help="planted near duplicates per checkpoint")
+    parser.add_argument("--edits", type=int, default=3, help="words changed in each planted near duplicate")
+    parser.add_argument("--disk", action="store_true", help="index in a SQLite file instead of memory")
+    args = parser.parse_args()
+    print(json.dumps(run(args.submissions, [int(c) for c in args.checkpoints.split(",")],
+                         args.queries, args.edits, disk=args.disk), indent=2))
@@ -0,0 +1,138 @@
+# benchmarks/fake_openai.py
+# Local OpenAI-compatible chat completions server for load tests: no network,
+# no API key, no bill. Latency, token counts and error rate are configurable.
+#
+#   python benchmarks/fake_openai.py [--port 8089] [--latency 0.3] [--jitter 0.1] [--error-rate 0.02]
+#
+# then point a client at it: OpenAI(base_url="http://127.0.0.1:8089/v1", api_key="sk-fake")
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class FakeOpenAIServer:
+    """
+    Answers POST .../chat/completions with a graded feedback message.
+
+    latency/jitter: seconds per response, uniformly latency ± jitter
+    prompt_tokens:  fixed prompt token count; None estimates it from the request size
+    completion_tokens: completion tokens reported per response
+    error_rate:     fraction of responses that fail with error_status
+                    (429s carry Retry-After: 0, so retrying clients don't stall)
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, prompt_tokens: Optional[int] = None,
+                 completion_tokens: int = 120, error_rate: float = 0.0, error_status: int = 429,
+                 port: int = 0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _draw(self):
+        with self._lock:
+            self.requests += 1
+            n = self.requests
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return n, delay, failed
+
+    def _completion(self, n: int, request: dict, request_bytes: int) -> bytes:
+        grade = 60 + n % 40
+        prompt_tokens = self.prompt_tokens if self.prompt_tokens is not None else max(1, request_bytes // 4)
+        return json.dumps({
+            "id": f"chatcmpl-fake-{n}", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant",
+                "content": f"Clear structure; a few details are missing.\nFINAL GRADE: {grade}/100",
+            }}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens,
+                      "total_tokens": prompt_tokens + self.completion_tokens},
+        }).encode("utf-8")
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                n, delay, failed = server._draw()
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    status = server.error_status
+                    payload = b'{"error": {"message": "fake failure", "type": "server_error"}}'
+                elif not self.path.endswith("/chat/completions"):
+                    status, payload = 404, b'{"error": {"message": "not found"}}'
+                else:
+                    status, payload = 200, server._completion(n, json.loads(raw or b"{}"), len(raw))
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeOpenAIServer(latency=args.latency, jitter=args.jitter, completion_tokens=args.completion_tokens,
+                            error_rate=args.error_rate, port=args.port).start()
+    print(f"Fake OpenAI listening on {fake.base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,109 @@
+# chunking.py
+# Split oversized submissions into token-bounded chunks on structural
+# boundaries: code at top-level function/class definitions, prose at section
+# headings. A piece that is still too big falls back to paragraphs, then
+# lines, then sentences, then a hard cut. Chunks concatenate back to the
+# original text exactly.
+
+import re
+from typing import Callable, List
+
+from token_estimator import count_tokens
+
+# Top-level (unindented) starts of a definition in the languages we grade
+_CODE_BOUNDARY = re.compile(
+    r"(?:@\w|(?:async\s+)?def\s|class\s|(?:export\s+)?(?:async\s+)?function\s|"
+    r"(?:public|private|protected|static|internal)\s|fn\s|func\s|impl\s|"
+    r"(?:export\s+)?(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:function|\())"
+)
+_DECORATOR = re.compile(r"@\w")
+# Markdown headings, numbered headings ("2.1 Method"), chapter lines
+_HEADING = re.compile(
+    r"(?:#{1,6}\s+\S|\d+(?:\.\d+)*\.?\s+[A-Z][^\n]{0,80}$|(?:chapter|section|part)\s+\w+)",
+    re.IGNORECASE,
+)
+# Finer split points for pieces that are still too big
+_FALLBACK_SPLITS = (
+    re.compile(r"(?<=\n\n)"),            # paragraphs
+    re.compile(r"(?<=\n)"),              # lines
+    re.compile(r"(?<=[.!?;])(?=\s)"),    # sentences
+)
+
+
+def _split_before(text: str, starts_block: Callable[[str, str], bool]) -> List[str]:
+    segments = []
+    current = []
+    previous = ""
+    for line in text.splitlines(keepends=True):
+        if current and starts_block(line, previous):
+            segments.append("".join(current))
+            current = []
+        current.append(line)
+        previous = line
+    if current:
+        segments.append("".join(current))
+    return segments
+
+
+def split_code(text: str) -> List[str]:
+    """Top-level definitions, each with the lines up to the next one (decorators stay attached)."""
+    return _split_before(
+        text, lambda line, previous: bool(_CODE_BOUNDARY.match(line)) and not _DECORATOR.match(previous)
+    )
+
+
+def split_prose(text: str) -> List[str]:
+    """Sections, each starting at a heading line (the first may have no heading)."""
+    return _split_before(text, lambda line, previous: bool(_HEADING.match(line.strip())) and not previous.strip().endswith(","))
+
+
+def split_structure(text: str, content_type: str) -> List[str]:
+    return split_code(text) if content_type == "code" else split_prose(text)
+
+
+def _hard_split(text: str, max_tokens: int, tokens: int) -> List[str]:
+    step = max(1, len(text) * max_tokens // max(tokens, 1))
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _fitting_pieces(piece: str, max_tokens: int, count: Callable[[str], int], level: int) -> List[str]:
+    # Split a piece on ever finer boundaries until every part fits
+    tokens = count(piece)
+    if tokens <= max_tokens:
+        return [piece]
+    if level >= len(_FALLBACK_SPLITS):
+        return _hard_split(piece, max_tokens, tokens)
+    finer = [p for p in _FALLBACK_SPLITS[level].split(piece) if p]
+    return [part for p in finer for part in _fitting_pieces(p, max_tokens, count, level + 1)]
+
+
+def _pack(pieces: List[str], max_tokens: int, count: Callable[[str], int]) -> List[str]:
+    # Greedily fill chunks with whole pieces, in order
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def chunk_text(text: str, content_type: str, max_tokens: int,
+               count: Callable[[str], int] = count_tokens) -> List[str]:
+    """
+    Split `text` into chunks of at most ~max_tokens tokens, preferring
+    structural boundaries. "".join(chunks) == text.
+    """
+    if count(text) <= max_tokens:
+        return [text]
+    pieces = [
+        part for segment in split_structure(text, content_type)
+        for part in _fitting_pieces(segment, max_tokens, count, 0)
+    ]
+    return _pack(pieces, max_tokens, count)
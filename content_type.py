@@ -0,0 +1,132 @@
+# content_type.py
+# Content-type classification ("code", "math" or "text") in one pass.
+#
+# All signals are alternatives of one compiled regex, so a single finditer
+# over the text counts every feature; each match adds its weight to the code
+# or math score. Signals are syntactic (a line starting "def name(", an
+# equation, a ∫), not bare words, so an essay saying "if" or "function" stays
+# text. Scores are divided by the line count; a type wins when its density
+# passes its threshold and beats the other one.
+#
+# Large texts are classified from a bounded sample: the first
+# SAMPLE_HEAD_CHARS and the last SAMPLE_TAIL_CHARS characters.
+
+import re
+from typing import Any, Dict, Iterable, List
+
+SAMPLE_HEAD_CHARS = 16 * 1024
+SAMPLE_TAIL_CHARS = 4 * 1024
+
+# (name, category, weight, pattern). Order matters: at each position the
+# first alternative that matches wins and consumes the text. Patterns start
+# with "^", "\b" or neither; see _compile.
+_FEATURES = [
+    # --- code: definitions and statements at the start of a line
+    ("py_def", "code", 3.0, r"^[ \t]*(?:async[ \t]+)?def[ \t]+\w+[ \t]*\("),
+    ("class_def", "code", 3.0, r"^[ \t]*(?:(?:public|private|abstract|final|export)[ \t]+)*class[ \t]+\w+(?:[ \t]+extends[ \t]+\w+)?[ \t]*[:({]"),
+    ("js_function", "code", 3.0, r"^[ \t]*(?:export[ \t]+)?(?:async[ \t]+)?function\*?[ \t]*\w*[ \t]*\("),
+    ("include", "code", 3.0, r"^[ \t]*#[ \t]*include[ \t]*[<\"]"),
+    ("py_import", "code", 3.0, r"^[ \t]*(?:import[ \t]+[\w.]+(?:[ \t]+as[ \t]+\w+)?(?:[ \t]*,[ \t]*[\w.]+)*|from[ \t]+[\w.]+[ \t]+import[ \t]+[\w*]+)[ \t]*;?[ \t]*$"),
+    ("declaration", "code", 2.0, r"^[ \t]*(?:const|let|var)[ \t]+\w+[ \t]*=|^[ \t]*(?:public|private|protected|static)[ \t]+[\w<>\[\], ]+[ \t]+\w+[ \t]*[(=;]"),
+    ("block_header", "code", 2.0, r"^[ \t]*(?:for|while|if|elif|else|try|except|finally|with)\b[^\n]*:[ \t]*$"),
+    ("c_control", "code", 2.0, r"^[ \t]*(?:\}[ \t]*)?(?:for|while|if|else[ \t]+if|switch|catch)[ \t]*\("),
+    ("return", "code", 2.0, r"^[ \t]*return\b[^\n]*$"),
+    ("line_comment", "code", 0.5, r"^[ \t]*(?://|/\*)"),
+    ("indent", "code", 0.5, r"^(?: {2,}|\t+)(?=\S)"),
+    ("builtin_call", "code", 2.0, r"\b(?:print|printf|println|console\.log|System\.out\.print(?:ln)?|len|range|self\.\w+)[ \t]*\("),
+    ("method_call", "code", 1.0, r"\b[A-Za-z_]\w*\.[A-Za-z_]\w*\("),
+    ("operator", "code", 1.0, r"==|!=|&&|\|\||->|=>|\+\+|\+=|-=|::"),
+    ("line_end", "code", 1.0, r"[;{}][ \t]*$"),
+    # --- math
+    ("latex", "math", 2.0, r"\\(?:frac|int|sum|prod|sqrt|lim|infty|alpha|beta|gamma|theta|lambda|pi|sigma|cdot|times|leq?|geq?|neq)\b"),
+    ("math_symbol", "math", 2.0, r"[∫∬∮∑∏√∛π∞≤≥≠≈±∓∂∆∇θλαβγσμΣΠΩ∈∉⊂⊆∪∩∀∃→⇒⇔×÷·⋅°′″¹²³⁴⁵⁶⁷⁸⁹⁰ⁿ½⅓¼]"),
+    ("math_function", "math", 1.5, r"\b(?:sin|cos|tan|cot|sec|csc|arcsin|arccos|arctan|sinh|cosh|tanh|log|ln|exp|lim|det|gcd|lcm)\b"),
+    ("differential", "math", 1.0, r"\bd[xyztθ]\b"),
+    ("coefficient", "math", 1.0, r"\b\d+[a-z]\b(?![a-z])"),
+    ("power", "math", 1.0, r"\b\w+[ \t]*\^[ \t]*[\w(]"),
+    ("arithmetic", "math", 1.5, r"\b\d+[ \t]*[-+*/×÷][ \t]*\(?\d"),
+    ("equals", "math", 0.7, r"(?<![=!<>+\-*/])=(?![=>])"),
+]
+
+
+def _compile(features) -> re.Pattern:
+    """
+    One regex for all features. Alternatives sharing a leading "^" or "\b"
+    are grouped under it, so most positions are rejected by a single anchor
+    test instead of by every alternative in turn.
+    """
+    groups = {"^": [], "\\b": [], "": []}
+    for name, _, _, pattern in features:
+        anchor = next(a for a in groups if pattern.startswith(a))
+        groups[anchor].append(f"(?P<{name}>{pattern[len(anchor):]})")
+    return re.compile(
+        "|".join(f"{anchor}(?:{'|'.join(group)})" for anchor, group in groups.items() if group),
+        re.MULTILINE,
+    )
+
+
+_PATTERN = _compile(_FEATURES)
+_WEIGHTS = {name: (category, weight) for name, category, weight, _ in _FEATURES}
+
+# Density (score per line, over at least MIN_LINES lines) a type needs to win
+CODE_THRESHOLD = 0.5
+MATH_THRESHOLD = 0.6
+MIN_LINES = 3
+
+
+def _sample(text: str) -> str:
+    if len(text) <= SAMPLE_HEAD_CHARS + SAMPLE_TAIL_CHARS:
+        return text
+    return text[:SAMPLE_HEAD_CHARS] + "\n" + text[-SAMPLE_TAIL_CHARS:]
+
+
+def classify(text: str) -> Dict[str, Any]:
+    """
+    Classify a submission.
+
+    Returns:
+        {
+            "content_type": "code" | "math" | "text",
+            "confidence": float,     # 0.5 (a toss-up) .. 1.0
+            "scores": {"code": float, "math": float}   # density / threshold; >= 1 qualifies
+        }
+    """
+    sample = _sample(text or "")
+    if not sample.strip():
+        return {"content_type": "text", "confidence": 1.0, "scores": {"code": 0.0, "math": 0.0}}
+    totals = {"code": 0.0, "math": 0.0}
+    for match in _PATTERN.finditer(sample):
+        category, weight = _WEIGHTS[match.lastgroup]
+        totals[category] += weight
+    lines = max(MIN_LINES, sample.count("\n") + 1)
+    code = totals["code"] / lines / CODE_THRESHOLD
+    math = totals["math"] / lines / MATH_THRESHOLD
+
+    best = max(code, math)
+    if best < 1.0:
+        content_type = "text"
+        confidence = 0.5 + 0.5 * (1.0 - best)
+    else:
+        content_type = "code" if code >= math else "math"
+        margin = (best - min(code, math)) / best
+        confidence = 0.5 + 0.5 * margin * (1.0 - 0.5 ** best)
+    return {
+        "content_type": content_type,
+        "confidence": round(confidence, 3),
+        "scores": {"code": round(code, 3), "math": round(math, 3)},
+    }
+
+
+def detect_content_type(text: str) -> str:
+    """Detect if text is code, math, or normal text."""
+    return classify(text)["content_type"]
+
+
+def classify_batch(texts: Iterable[str], executor=None, chunksize: int = 64) -> List[Dict[str, Any]]:
+    """
+    classify() many submissions, in input order. Pass an executor (e.g. a
+    ProcessPoolExecutor) to spread large batches over CPUs.
+    """
+    if executor is None:
+        return [classify(text) for text in texts]
+    return list(executor.map(classify, texts, chunksize=chunksize))
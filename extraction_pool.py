@@ -0,0 +1,296 @@
+# extraction_pool.py
+# Long-lived, pre-warmed worker processes for PDF/DOCX extraction.
+# PyMuPDF and python-docx parsing is CPU-bound and holds the GIL, so doing it
+# inside a request thread stalls every other request in the worker.
+#
+# - workers import PyMuPDF / python-docx before taking their first job
+# - per-job timeout: a stuck worker is killed and replaced
+# - memory limit: RLIMIT_AS inside each worker (Unix only)
+# - workers are recycled after N jobs to cap leaks/fragmentation
+# - tiny files are extracted in-process; process hand-off would cost more
+# - large PDFs are split into page ranges across the workers
+# - large sources reach the workers as a file path (spilled to a temp file if
+#   they aren't one already) instead of being pickled through the pipe
+#
+# Environment:
+#   EXTRACTION_POOL=0                  extract in-process (no workers)
+#   EXTRACTION_WORKERS                 worker processes (default: min(4, CPU count))
+#   EXTRACTION_TIMEOUT                 seconds per job (default 60)
+#   EXTRACTION_MAX_JOBS_PER_WORKER     recycle after this many jobs (default 200)
+#   EXTRACTION_MEMORY_LIMIT_MB         address-space limit per worker (default 2048, 0 = none)
+#   EXTRACTION_INLINE_BYTES            extract in-process below this size (default 65536)
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from extraction import (
+    DOCX_AVAILABLE, PDF_PARALLEL_MIN_PAGES, Source, extract_document, extract_pdf, pdf_page_count,
+    source_size, spill_to_path,
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ExtractionTimeout(TimeoutError):
+    pass
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    if resource is not None and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # pay for the parser imports now, not on the first job's clock
+    try:
+        import fitz  # noqa: F401
+    except ImportError:
+        pass
+    if DOCX_AVAILABLE:
+        import docx  # noqa: F401
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            conn.send(("ok", fn(*args)))
+        except BaseException as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx, memory_limit_mb: int):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, memory_limit_mb), daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+        self.ready = False
+
+    def wait_ready(self):
+        """Block until the worker has imported its parsers."""
+        if self.ready:
+            return
+        try:
+            self.conn.recv()
+        except EOFError:
+            raise WorkerCrashed(f"extraction worker exited with code {self.process.exitcode} while starting")
+        self.ready = True
+
+    def call(self, fn: Callable, args: tuple, timeout: Optional[float]):
+        # warm-up doesn't count against the job's timeout
+        self.wait_ready()
+        self.jobs += 1
+        self.conn.send((fn, args))
+        if not self.conn.poll(timeout):
+            raise ExtractionTimeout(f"extraction timed out after {timeout}s")
+        try:
+            status, value = self.conn.recv()
+        except EOFError:
+            raise WorkerCrashed(f"extraction worker exited with code {self.process.exitcode}")
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+    def stop(self, kill: bool = False):
+        if not kill:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionService:
+    """
+    Pool of extraction worker processes.
+    submit()/run() give concurrent.futures.Future, extract_async() awaits,
+    extract() blocks - all return text (failures as ⚠️ strings, like the
+    in-process extractors).
+    """
+
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = 60.0,
+                 max_jobs_per_worker: int = 200, memory_limit_mb: int = 2048,
+                 inline_bytes: int = 64 * 1024):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.memory_limit_mb = memory_limit_mb
+        self.inline_bytes = inline_bytes
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        # the counters below are bumped from caller, front and dispatcher threads
+        self._counter_lock = threading.Lock()
+        # one dispatcher thread per worker process, plus front threads that
+        # may fan a large PDF out into several jobs
+        self._dispatch = None
+        self._front = None
+        self.started = False
+        self.jobs = 0
+        self.inline_jobs = 0
+        self.timeouts = 0
+        self.recycled = 0
+
+    @classmethod
+    def from_env(cls) -> "ExtractionService":
+        return cls(
+            workers=int(os.getenv("EXTRACTION_WORKERS", "0")) or None,
+            timeout=float(os.getenv("EXTRACTION_TIMEOUT", "60")),
+            max_jobs_per_worker=int(os.getenv("EXTRACTION_MAX_JOBS_PER_WORKER", "200")),
+            memory_limit_mb=int(os.getenv("EXTRACTION_MEMORY_LIMIT_MB", "2048")),
+            inline_bytes=int(os.getenv("EXTRACTION_INLINE_BYTES", str(64 * 1024))),
+        )
+
+    def start(self):
+        """Spawn (pre-warm) the worker processes. Called lazily on first use."""
+        with self._lock:
+            if self.started:
+                return
+            workers = [_Worker(self._ctx, self.memory_limit_mb) for _ in range(self.workers)]
+            for worker in workers:
+                worker.wait_ready()
+                self._idle.put(worker)
+            self._dispatch = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="extract-dispatch")
+            self._front = ThreadPoolExecutor(max_workers=self.workers * 2, thread_name_prefix="extract")
+            self.started = True
+
+    def _spawn(self) -> Optional[_Worker]:
+        # None keeps the slot: it is respawned by the next job that takes it
+        try:
+            return _Worker(self._ctx, self.memory_limit_mb)
+        except Exception:
+            return None
+
+    def _run_on_worker(self, fn: Callable, args: tuple, timeout: Optional[float]):
+        worker = self._idle.get()
+        replace = False
+        try:
+            if worker is None:
+                worker = _Worker(self._ctx, self.memory_limit_mb)
+            return worker.call(fn, args, timeout)
+        except ExtractionTimeout:
+            self._count("timeouts")
+            replace = True
+            raise
+        except (WorkerCrashed, OSError):
+            replace = True
+            raise
+        finally:
+            # every slot goes back to the idle queue, even if its replacement can't start
+            if worker is not None and (replace or worker.jobs >= self.max_jobs_per_worker):
+                worker.stop(kill=replace)
+                if not replace:
+                    self._count("recycled")
+                worker = self._spawn()
+            self._idle.put(worker)
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None) -> Future:
+        """Run a picklable top-level fn(*args) on a worker process."""
+        self.start()
+        self._count("jobs")
+        return self._dispatch.submit(self._run_on_worker, fn, args, timeout or self.timeout)
+
+    # executor protocol, so extract_pdf can fan page ranges out onto the workers
+    submit = run
+
+    def extract(self, source: Source, file_type: str) -> str:
+        """Blocking extraction of a "pdf"/"docx" source (bytes, buffer, path or file object)."""
+        if source_size(source) < self.inline_bytes:
+            self._count("inline_jobs")
+            return extract_document(source, file_type)
+        try:
+            with spill_to_path(source) as path:
+                if file_type == "pdf" and pdf_page_count(path) >= PDF_PARALLEL_MIN_PAGES:
+                    return extract_pdf(path, parallel=True, executor=self)["text"]
+                return self.run(extract_document, path, file_type, False).result()
+        except Exception as e:
+            label = "PDF" if file_type == "pdf" else "Word document"
+            return f"⚠️ {label} extraction failed: {e}"
+
+    def submit_extract(self, source: Source, file_type: str) -> Future:
+        """Non-blocking extract(); returns a Future of the text."""
+        self.start()
+        return self._front.submit(self.extract, source, file_type)
+
+    async def extract_async(self, source: Source, file_type: str) -> str:
+        return await asyncio.wrap_future(self.submit_extract(source, file_type))
+
+    def _count(self, name: str):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counter_lock:
+            return {
+                "workers": self.workers,
+                "started": self.started,
+                "jobs": self.jobs,
+                "inline_jobs": self.inline_jobs,
+                "timeouts": self.timeouts,
+                "recycled": self.recycled,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if not self.started:
+                return
+            self._front.shutdown(wait=True)
+            self._dispatch.shutdown(wait=True)
+            while not self._idle.empty():
+                worker = self._idle.get_nowait()
+                if worker is not None:
+                    worker.stop()
+            self.started = False
+
+
+class _InProcessService(ExtractionService):
+    """EXTRACTION_POOL=0: same API, everything runs in the calling process."""
+
+    def extract(self, source: Source, file_type: str) -> str:
+        self._count("inline_jobs")
+        return extract_document(source, file_type)
+
+    def submit_extract(self, source: Source, file_type: str) -> Future:
+        future = Future()
+        future.set_result(self.extract(source, file_type))
+        return future
+
+    async def extract_async(self, source: Source, file_type: str) -> str:
+        return await asyncio.to_thread(self.extract, source, file_type)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def extraction_service() -> ExtractionService:
+    """The shared extraction service (workers start on first non-tiny job)."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                if os.getenv("EXTRACTION_POOL", "1") == "0":
+                    _service = _InProcessService()
+                else:
+                    _service = ExtractionService.from_env()
+    return _service
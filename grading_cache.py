@@ -0,0 +1,294 @@
+# grading_cache.py
+# Content-addressed cache of grading results.
+# Key = sha256(normalized text, content type, model, prompt version), so an
+# identical resubmission (or a re-run over the same class set) skips the model
+# call. Two tiers: an in-memory LRU and an optional SQLite file on disk, both
+# with TTL and size-based eviction.
+#
+# SingleFlight coalesces concurrent identical requests that miss the cache:
+# the first caller runs the model call, the rest wait and share its result
+# (if it is shareable - a quota error for one user is not another's answer).
+#
+# Environment:
+#   GRADING_CACHE=0          disable caching
+#   GRADING_CACHE_SIZE       in-memory entries (default 1024)
+#   GRADING_CACHE_TTL        seconds an entry stays valid (default 7 days)
+#   GRADING_CACHE_DIR        enable the disk tier in this directory
+#   GRADING_CACHE_DISK_SIZE  disk entries (default 100000)
+#
+# The shared cache is built on first use by grading_cache(), so importing
+# this module touches no files.
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Bump when grading semantics change in a way the prompt text doesn't show
+CACHE_SCHEMA = "1"
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form for hashing: NFC, LF line endings, no trailing whitespace."""
+    text = unicodedata.normalize("NFC", text or "")
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def cache_key(text: str, content_type: str, model: str, prompt_version: str) -> str:
+    digest = hashlib.sha256()
+    for part in (CACHE_SCHEMA, content_type, model, prompt_version, normalize_text(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class GradingCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 7 * 86400,
+                 disk_dir: Optional[str] = None, max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.enabled = True
+        self._memory = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk = sqlite3.connect(os.path.join(disk_dir, "grading_cache.db"),
+                                         timeout=30, isolation_level=None, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, result TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results (last_access)")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "GradingCache":
+        cache = cls(
+            max_entries=int(os.getenv("GRADING_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("GRADING_CACHE_TTL", str(7 * 86400))),
+            disk_dir=os.getenv("GRADING_CACHE_DIR") or None,
+            max_disk_entries=int(os.getenv("GRADING_CACHE_DISK_SIZE", "100000")),
+        )
+        cache.enabled = os.getenv("GRADING_CACHE", "1") != "0"
+        return cache
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._memory[key]
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT result, expires_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._disk.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+                    result = json.loads(row[0])
+                    self._remember(key, row[1], result)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return dict(result)
+                if row:
+                    self._disk.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        if not self.enabled:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, dict(result))
+            self.stores += 1
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO results (key, result, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(result, ensure_ascii=False), expires_at, now),
+                )
+                excess = self._disk.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_disk_entries
+                if excess > 0:
+                    self._disk.execute(
+                        "DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY last_access LIMIT ?)", (excess,)
+                    )
+                    self.evictions += excess
+
+    def _remember(self, key, expires_at, result):
+        self._memory[key] = (expires_at, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM results")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time; concurrent callers with the same
+    key wait for it and share the result (or exception). Works for threads
+    (do) and within an event loop (do_async); the two don't coalesce with
+    each other.
+
+    With shareable, a waiter only takes a result for which shareable(result)
+    is true; otherwise it runs fn itself (e.g. under its own user's quota).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = weakref.WeakKeyDictionary()  # loop -> {key: Future}
+        self.calls = 0
+        self.deduplicated = 0
+        self.reruns = 0
+
+    def do(self, key: str, fn: Callable[[], Any],
+           shareable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """Returns (result, shared) - shared is True if another caller's result was reused."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.deduplicated += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if shareable is None or shareable(flight.result):
+                return flight.result, True
+            with self._lock:
+                self.deduplicated -= 1
+                self.reruns += 1
+            return fn(), False
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]],
+                       shareable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """Async do(): fn is a coroutine function."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            flights = self._async_flights.setdefault(loop, {})
+            future = flights.get(key)
+            leader = future is None
+            if leader:
+                future = flights[key] = loop.create_future()
+                self.calls += 1
+            else:
+                self.deduplicated += 1
+        if not leader:
+            # shield: one waiter being cancelled mustn't cancel the shared call
+            result = await asyncio.shield(future)
+            if shareable is None or shareable(result):
+                return result, True
+            with self._lock:
+                self.deduplicated -= 1
+                self.reruns += 1
+            return await fn(), False
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            with self._lock:
+                del flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "deduplicated": self.deduplicated,
+                "reruns": self.reruns,
+                "in_flight": len(self._flights) + sum(len(f) for f in self._async_flights.values()),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def grading_cache() -> GradingCache:
+    """The shared grading cache (configured from the environment on first use)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GradingCache.from_env()
+    return _cache
+
+
+def set_grading_cache(cache: Optional[GradingCache]):
+    """Replace the shared cache (None: rebuild from the environment on next use)."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+grading_flights = SingleFlight()
@@ -0,0 +1,267 @@
+# http_transport.py
+# One explicitly configured HTTP connection pool for every OpenAI call, sync
+# and async: keep-alive, pool limits, HTTP/2 when the h2 package is installed.
+# The async pool is per event loop (its connections belong to the loop that
+# opened them); the sync pool is per process.
+#
+# Retries live in the transport (the OpenAI client is built with
+# max_retries=0): 429, 5xx and connection/timeout errors are retried with
+# jittered exponential backoff, and a Retry-After / retry-after-ms header
+# from the server wins over the computed delay. Every attempt is timed;
+# transport_metrics.stats() reports counts and latency percentiles.
+#
+# Environment:
+#   OPENAI_HTTP_MAX_CONNECTIONS    pool size (default 100)
+#   OPENAI_HTTP_MAX_KEEPALIVE      idle connections kept open (default 20)
+#   OPENAI_HTTP_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 30)
+#   OPENAI_HTTP_TIMEOUT            read timeout in seconds (default 120)
+#   OPENAI_HTTP2=0                 disable HTTP/2 even if h2 is installed
+#   OPENAI_MAX_RETRIES             retries after the first attempt (default 4)
+#   OPENAI_BACKOFF_BASE            first backoff in seconds (default 0.5)
+#   OPENAI_BACKOFF_MAX             longest single wait in seconds (default 30)
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - only needed by httpx for HTTP/2
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+MAX_CONNECTIONS = int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE = int(os.getenv("OPENAI_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY", "30"))
+READ_TIMEOUT = float(os.getenv("OPENAI_HTTP_TIMEOUT", "120"))
+HTTP2 = H2_AVAILABLE and os.getenv("OPENAI_HTTP2", "1") != "0"
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+RETRY_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+
+
+def retry_after(headers) -> Optional[float]:
+    """Seconds the server asked us to wait (retry-after-ms, Retry-After seconds or HTTP date)."""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, headers=None, base: Optional[float] = None, cap: Optional[float] = None) -> float:
+    """
+    Wait before retry number `attempt` (1-based): full-jitter exponential
+    backoff, or the server's Retry-After when it sent one (capped).
+    """
+    base = BACKOFF_BASE if base is None else base
+    cap = BACKOFF_MAX if cap is None else cap
+    asked = retry_after(headers) if headers is not None else None
+    if asked is not None:
+        return min(asked, cap)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class TransportMetrics:
+    """Per-attempt counters and a window of recent attempt latencies."""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0  # gave up: retries exhausted or non-retryable error
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.backoff_seconds = 0.0
+
+    def attempt(self, seconds: float, status: Optional[int] = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self.attempts += 1
+            self._latencies.append(seconds)
+            if status is not None:
+                self.statuses[status] += 1
+            if error is not None:
+                self.errors[type(error).__name__] += 1
+
+    def retried(self, delay: float):
+        with self._lock:
+            self.retries += 1
+            self.backoff_seconds += delay
+
+    def finished(self, ok: bool):
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.failures += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+            def pct(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4) if latencies else 0.0
+            return {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "failures": self.failures,
+                "statuses": dict(self.statuses),
+                "errors": dict(self.errors),
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "latency_p50": pct(0.50),
+                "latency_p99": pct(0.99),
+                "latency_max": round(latencies[-1], 4) if latencies else 0.0,
+            }
+
+
+transport_metrics = TransportMetrics()
+
+
+class RetryTransport(httpx.BaseTransport):
+    """Wraps a transport: times every attempt, retries transient failures."""
+
+    def __init__(self, transport: httpx.BaseTransport, max_retries: Optional[int] = None,
+                 metrics: TransportMetrics = transport_metrics, sleep=time.sleep):
+        self._transport = transport
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.metrics = metrics
+        self._sleep = sleep
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            began = time.perf_counter()
+            try:
+                response = self._transport.handle_request(request)
+            except RETRY_ERRORS as e:
+                self.metrics.attempt(time.perf_counter() - began, error=e)
+                if attempt >= self.max_retries:
+                    self.metrics.finished(False)
+                    raise
+                headers = None
+            else:
+                self.metrics.attempt(time.perf_counter() - began, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self.metrics.finished(response.status_code < 400)
+                    return response
+                headers = response.headers
+                response.read()
+                response.close()
+            attempt += 1
+            delay = backoff_delay(attempt, headers)
+            self.metrics.retried(delay)
+            self._sleep(delay)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """Async RetryTransport."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_retries: Optional[int] = None,
+                 metrics: TransportMetrics = transport_metrics, sleep=asyncio.sleep):
+        self._transport = transport
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.metrics = metrics
+        self._sleep = sleep
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            began = time.perf_counter()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except RETRY_ERRORS as e:
+                self.metrics.attempt(time.perf_counter() - began, error=e)
+                if attempt >= self.max_retries:
+                    self.metrics.finished(False)
+                    raise
+                headers = None
+            else:
+                self.metrics.attempt(time.perf_counter() - began, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self.metrics.finished(response.status_code < 400)
+                    return response
+                headers = response.headers
+                await response.aread()
+                await response.aclose()
+            attempt += 1
+            delay = backoff_delay(attempt, headers)
+            self.metrics.retried(delay)
+            await self._sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(READ_TIMEOUT, connect=10.0)
+
+
+def make_http_client(max_retries: Optional[int] = None, metrics: TransportMetrics = transport_metrics,
+                     **transport_options) -> httpx.Client:
+    """A pooled, retrying httpx.Client (pass it to OpenAI(http_client=...))."""
+    transport = httpx.HTTPTransport(http2=HTTP2, limits=_limits(), **transport_options)
+    return httpx.Client(transport=RetryTransport(transport, max_retries, metrics), timeout=_timeout())
+
+
+def make_async_http_client(max_retries: Optional[int] = None, metrics: TransportMetrics = transport_metrics,
+                           **transport_options) -> httpx.AsyncClient:
+    """Async make_http_client (pass it to AsyncOpenAI(http_client=...))."""
+    transport = httpx.AsyncHTTPTransport(http2=HTTP2, limits=_limits(), **transport_options)
+    return httpx.AsyncClient(transport=AsyncRetryTransport(transport, max_retries, metrics), timeout=_timeout())
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+# event loop -> its async client; dropped with the loop
+_shared_async = weakref.WeakKeyDictionary()
+
+
+def shared_http_client() -> httpx.Client:
+    """The process-wide pooled client used by every sync OpenAI call."""
+    with _shared_lock:
+        if "sync" not in _shared:
+            _shared["sync"] = make_http_client()
+        return _shared["sync"]
+
+
+def shared_async_http_client() -> httpx.AsyncClient:
+    """The running event loop's pooled client, used by every async OpenAI call on that loop."""
+    loop = asyncio.get_running_loop()
+    with _shared_lock:
+        client = _shared_async.get(loop)
+        if client is None:
+            client = _shared_async[loop] = make_async_http_client()
+        return client
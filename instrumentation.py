@@ -0,0 +1,287 @@
+# instrumentation.py
+# Per-stage timing for the grading pipeline: base64 decode, extraction,
+# content-type detection, rate-limit waits, the model call, grade parsing,
+# quota bookkeeping and storage writes.
+#
+#   with stage("extract") as timing:
+#       text = ...
+#       timing.add(nbytes=len(data))
+#
+# Every stage feeds a latency histogram (plus byte/token counters) that
+# render_metrics() prints in Prometheus text format (GET /metrics in main.py).
+# Inside trace(), the stages of one grading are also collected so they can be
+# attached to its result dict as "timings". Stages may nest (a storage write
+# inside token_manager.commit), so their times don't add up to the total.
+#
+# Disabled (the default), stage() returns a shared no-op object and trace()
+# yields None: one global check per stage.
+#
+# Environment:
+#   AUTOGRADER_METRICS=1   record stage histograms
+#   AUTOGRADER_TIMINGS=1   also attach per-stage "timings" to each result
+
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS_ENABLED = os.getenv("AUTOGRADER_METRICS", "0") == "1"
+TIMINGS_ENABLED = os.getenv("AUTOGRADER_TIMINGS", "0") == "1"
+_ENABLED = METRICS_ENABLED or TIMINGS_ENABLED
+
+
+def configure(metrics: Optional[bool] = None, timings: Optional[bool] = None):
+    """Turn histogram recording and/or per-result timings on or off at runtime."""
+    global METRICS_ENABLED, TIMINGS_ENABLED, _ENABLED
+    if metrics is not None:
+        METRICS_ENABLED = bool(metrics)
+    if timings is not None:
+        TIMINGS_ENABLED = bool(timings)
+    _ENABLED = METRICS_ENABLED or TIMINGS_ENABLED
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, Prometheus style."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class StageMetrics:
+    """Histograms and byte/token counters per stage name. Thread-safe."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}  # name -> [Histogram, bytes, tokens]
+
+    def record(self, name: str, seconds: float, nbytes: int = 0, tokens: int = 0):
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                entry = self._stages[name] = [Histogram(self.buckets), 0, 0]
+            entry[0].observe(seconds)
+            entry[1] += nbytes
+            entry[2] += tokens
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "count": hist.count,
+                    "seconds": round(hist.sum, 6),
+                    "p50": hist.quantile(0.5),
+                    "p99": hist.quantile(0.99),
+                    "bytes": nbytes,
+                    "tokens": tokens,
+                }
+                for name, (hist, nbytes, tokens) in self._stages.items()
+            }
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = [
+            "# HELP autograder_stage_seconds Time spent in each grading stage.",
+            "# TYPE autograder_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted((name, entry[0], entry[1], entry[2]) for name, entry in self._stages.items())
+            for name, hist, _, _ in stages:
+                label = _label(name)
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f'autograder_stage_seconds_bucket{{stage="{label}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'autograder_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {hist.count}')
+                lines.append(f'autograder_stage_seconds_sum{{stage="{label}"}} {hist.sum:.6f}')
+                lines.append(f'autograder_stage_seconds_count{{stage="{label}"}} {hist.count}')
+            for metric, index, help_text in (
+                ("autograder_stage_bytes_total", 2, "Bytes processed by each grading stage."),
+                ("autograder_stage_tokens_total", 3, "Model tokens used by each grading stage."),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for entry in stages:
+                    if entry[index]:
+                        lines.append(f'{metric}{{stage="{_label(entry[0])}"}} {entry[index]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_metrics = StageMetrics()
+
+
+class Trace:
+    """Per-stage totals for one grading, collected across threads and tasks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name: str, seconds: float, nbytes: int, tokens: int):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = {"seconds": 0.0, "calls": 0, "bytes": 0, "tokens": 0}
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+            entry["bytes"] += nbytes
+            entry["tokens"] += tokens
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {
+                name: {**entry, "seconds": round(entry["seconds"], 6)}
+                for name, entry in self.stages.items()
+            }
+        timings["total"] = {"seconds": round(time.perf_counter() - self.started, 6)}
+        return timings
+
+
+_trace = contextvars.ContextVar("autograder_trace", default=None)
+
+
+class _Stage:
+    __slots__ = ("name", "nbytes", "tokens", "_began")
+
+    def __init__(self, name: str, nbytes: int, tokens: int):
+        self.name = name
+        self.nbytes = nbytes
+        self.tokens = tokens
+
+    def add(self, nbytes: int = 0, tokens: int = 0):
+        self.nbytes += nbytes
+        self.tokens += tokens
+
+    def __enter__(self):
+        self._began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._began
+        if METRICS_ENABLED:
+            stage_metrics.record(self.name, seconds, self.nbytes, self.tokens)
+        current = _trace.get()
+        if current is not None:
+            current.add(self.name, seconds, self.nbytes, self.tokens)
+        return False
+
+
+class _NullStage:
+    """stage() while disabled. Falsy, so callers can skip measuring sizes."""
+    __slots__ = ()
+
+    def add(self, nbytes: int = 0, tokens: int = 0):
+        pass
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, nbytes: int = 0, tokens: int = 0):
+    """Context manager timing one stage; .add(nbytes=, tokens=) records sizes."""
+    if not _ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, nbytes, tokens)
+
+
+def timed(name: str) -> Callable:
+    """Decorator: time every call of the function as stage `name`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return fn(*args, **kwargs)
+            with _Stage(name, 0, 0):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def trace() -> Iterator[Optional[Trace]]:
+    """
+    Collect the stages of one grading. Yields a Trace only to the outermost
+    caller while AUTOGRADER_TIMINGS is on (None otherwise); nested calls
+    record into it.
+    """
+    if not TIMINGS_ENABLED or _trace.get() is not None:
+        yield None
+        return
+    current = Trace()
+    token = _trace.set(current)
+    try:
+        yield current
+    finally:
+        _trace.reset(token)
+
+
+def attach(result: Dict[str, Any], current: Optional[Trace]) -> Dict[str, Any]:
+    """Add current's timings to a result dict (in place); no-op for None."""
+    if current is not None:
+        result["timings"] = current.as_dict()
+    return result
+
+
+def propagate(fn: Callable) -> Callable:
+    """Wrap fn so stages it records on another thread join the caller's trace."""
+    current = _trace.get()
+    if current is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _trace.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _trace.reset(token)
+    return run
+
+
+def render_metrics() -> str:
+    """Stage histograms in Prometheus text format."""
+    return stage_metrics.render()
@@ -0,0 +1,455 @@
+# job_queue.py
+# Durable grading job queue: submit -> job id -> poll (get/wait) or callback.
+#
+# Jobs live in a SQLite file, so a restart loses nothing: running jobs whose
+# worker died (or whose lease ran out) go back to the queue and are re-run,
+# up to JOB_QUEUE_MAX_ATTEMPTS times. Workers renew the lease of the jobs they
+# are running every lease_seconds / 3, so a long grading keeps its lease, and
+# a run only finishes a job it still owns (owner = host:pid:uuid, unique per
+# process), so a run that lost its lease can't overwrite the re-run.
+#
+# Two priority classes: "interactive" jobs (a student waiting) are always
+# claimed before "bulk" jobs (class uploads), and some workers only ever take
+# interactive jobs, so a bulk upload can't occupy the whole pool.
+#
+# Each class has a bounded depth (queued + running). submit() raises
+# QueueFull with a retry_after hint when it is reached; accepting() and
+# stats() let callers shed load before that (e.g. answer 429/503).
+#
+# Environment:
+#   JOB_QUEUE_DB                 SQLite file (default jobs.db; relative paths are next to this module)
+#   JOB_QUEUE_MAX_INTERACTIVE    max interactive jobs queued or running (default 200)
+#   JOB_QUEUE_MAX_BULK           max bulk jobs queued or running (default 5000)
+#   JOB_QUEUE_MAX_ATTEMPTS       runs per job before it is marked failed (default 3)
+#   JOB_QUEUE_LEASE_SECONDS      a running job not renewed for this long is presumed dead (default 300)
+#   JOB_QUEUE_WORKERS            worker threads (default 4)
+#   JOB_QUEUE_INTERACTIVE_WORKERS  of those, reserved for interactive jobs (default 1)
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+PRIORITIES = {"interactive": 0, "bulk": 1}
+KINDS = ("text", "file", "base64")
+
+# Anchored to this directory, like storage.py's files: every worker shares
+# one queue whatever directory it was started from
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("JOB_QUEUE_DB", "jobs.db"))
+
+
+class QueueFull(Exception):
+    """Backpressure: the priority class is at its depth limit."""
+
+    def __init__(self, priority: str, depth: int, retry_after: float):
+        super().__init__(f"{priority} queue is full ({depth} jobs); retry in ~{retry_after:.0f}s")
+        self.priority = priority
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+_owner_token = None
+_owner_pid = None
+
+
+def _owner() -> str:
+    """This process's lease owner token: host:pid:uuid (new after a fork)."""
+    global _owner_token, _owner_pid
+    if _owner_pid != os.getpid():
+        _owner_pid = os.getpid()
+        _owner_token = f"{socket.gethostname()}:{_owner_pid}:{uuid.uuid4().hex}"
+    return _owner_token
+
+
+def _owner_dead(owner: str, host: str) -> bool:
+    # Only decidable for this host: the pid is gone, or it is our own pid
+    # under another token (pid reused, e.g. pid 1 after a container restart)
+    owner_host, pid, token = (owner.split(":") + ["", ""])[:3]
+    if owner_host != host or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return owner != _owner()
+    return not _pid_alive(int(pid))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, db_path: Optional[str] = None, max_interactive: int = 200, max_bulk: int = 5000,
+                 max_attempts: int = 3, lease_seconds: float = 300.0):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self.limits = {"interactive": max_interactive, "bulk": max_bulk}
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, priority INTEGER NOT NULL, kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL, data BLOB, user_id TEXT, callback_url TEXT,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " owner TEXT, lease_until REAL, result TEXT, error TEXT,"
+            " created REAL NOT NULL, started REAL, finished REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, created)")
+        # recent run times, for the retry_after hint
+        self._durations = []
+
+    @classmethod
+    def from_env(cls, db_path: Optional[str] = None) -> "JobQueue":
+        return cls(
+            db_path=db_path,
+            max_interactive=int(os.getenv("JOB_QUEUE_MAX_INTERACTIVE", "200")),
+            max_bulk=int(os.getenv("JOB_QUEUE_MAX_BULK", "5000")),
+            max_attempts=int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "3")),
+            lease_seconds=float(os.getenv("JOB_QUEUE_LEASE_SECONDS", "300")),
+        )
+
+    def _transaction(self, fn: Callable[[], Any]):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn()
+                self._db.execute("COMMIT")
+                return value
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _depth(self, priority: int) -> int:
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE priority = ? AND status IN ('queued', 'running')", (priority,)
+        ).fetchone()[0]
+
+    def _retry_after(self) -> float:
+        # a slot frees up when a running job finishes: about one average run
+        average = sum(self._durations) / len(self._durations) if self._durations else 5.0
+        return max(1.0, average)
+
+    # ------------------------------------------------------------------ submit
+
+    def submit(self, kind: str, payload: Dict[str, Any], priority: str = "interactive",
+               user_id: Optional[str] = None, data: Optional[bytes] = None,
+               callback_url: Optional[str] = None) -> str:
+        """
+        Enqueue a grading job. Returns its id.
+
+        Args:
+            kind: "text" (payload: content, content_type), "file" (data + payload: filename)
+                  or "base64" (payload: base64, file_type)
+            priority: "interactive" or "bulk"
+            callback_url: POSTed the finished job as JSON (best effort)
+
+        Raises QueueFull when the priority class is at its depth limit.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind: {kind!r}")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority!r}")
+        job_id = uuid.uuid4().hex
+
+        def insert():
+            depth = self._depth(PRIORITIES[priority])
+            if depth >= self.limits[priority]:
+                raise QueueFull(priority, depth, self._retry_after())
+            self._db.execute(
+                "INSERT INTO jobs (id, priority, kind, payload, data, user_id, callback_url, status, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, PRIORITIES[priority], kind, json.dumps(payload), data, user_id, callback_url, time.time()),
+            )
+        self._transaction(insert)
+        return job_id
+
+    def submit_text(self, content: str, content_type: Optional[str] = None, **options) -> str:
+        return self.submit("text", {"content": content, "content_type": content_type}, **options)
+
+    def submit_file(self, file_bytes: bytes, filename: str, **options) -> str:
+        return self.submit("file", {"filename": filename}, data=bytes(file_bytes), **options)
+
+    def submit_base64(self, base64_string: str, file_type: str = "text", **options) -> str:
+        return self.submit("base64", {"base64": base64_string, "file_type": file_type}, **options)
+
+    def accepting(self, priority: str = "interactive") -> bool:
+        """False while submit() for this class would raise QueueFull."""
+        with self._lock:
+            return self._depth(PRIORITIES[priority]) < self.limits[priority]
+
+    # ------------------------------------------------------------------ workers
+
+    def claim(self, priorities: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Take the next queued job (interactive first, then oldest) and lease it to this process."""
+        allowed = [PRIORITIES[p] for p in (priorities or PRIORITIES)]
+        marks = ",".join("?" * len(allowed))
+
+        def take():
+            row = self._db.execute(
+                f"SELECT * FROM jobs WHERE status = 'queued' AND priority IN ({marks})"
+                " ORDER BY priority, created LIMIT 1", allowed
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?,"
+                " lease_until = ?, started = ? WHERE id = ?",
+                (_owner(), now + self.lease_seconds, now, row["id"]),
+            )
+            job = dict(row)
+            job["attempts"] += 1
+            return job
+        return self._transaction(take)
+
+    def renew(self, job_ids: List[str]) -> int:
+        """Extend the lease of running jobs this process owns. Returns how many were renewed."""
+        if not job_ids:
+            return 0
+        marks = ",".join("?" * len(job_ids))
+        return self._transaction(lambda: self._db.execute(
+            f"UPDATE jobs SET lease_until = ? WHERE status = 'running' AND owner = ? AND id IN ({marks})",
+            (time.time() + self.lease_seconds, _owner(), *job_ids),
+        ).rowcount)
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> bool:
+        """Store the result. False if this process no longer owns the job (it was recovered)."""
+        now = time.time()
+
+        def finish():
+            row = self._db.execute("SELECT started FROM jobs WHERE id = ? AND owner = ? AND status = 'running'",
+                                   (job_id, _owner())).fetchone()
+            if row is None:
+                return False
+            if row["started"]:
+                self._durations = (self._durations + [now - row["started"]])[-100:]
+            self._db.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, data = NULL, finished = ?,"
+                " lease_until = NULL WHERE id = ? AND owner = ?",
+                (json.dumps(result, ensure_ascii=False), now, job_id, _owner()),
+            )
+            return True
+        return self._transaction(finish)
+
+    def fail(self, job_id: str, error: str) -> bool:
+        """
+        A run raised: re-queue the job, or mark it failed after max_attempts.
+        False if this process no longer owns the job.
+        """
+        def record():
+            return self._db.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+                " error = ?, owner = NULL, lease_until = NULL,"
+                " finished = CASE WHEN attempts >= ? THEN ? ELSE NULL END"
+                " WHERE id = ? AND owner = ? AND status = 'running'",
+                (self.max_attempts, error, self.max_attempts, time.time(), job_id, _owner()),
+            ).rowcount > 0
+        return self._transaction(record)
+
+    def recover(self) -> int:
+        """
+        Re-queue running jobs whose worker is gone: the lease expired (it is
+        renewed while the job runs), or the owning process on this host no
+        longer exists. Returns how many.
+        """
+        host = socket.gethostname()
+        now = time.time()
+
+        def sweep():
+            orphaned = []
+            for row in self._db.execute("SELECT id, owner, lease_until FROM jobs WHERE status = 'running'"):
+                if _owner_dead(row["owner"] or "", host) or (row["lease_until"] or 0) < now:
+                    orphaned.append(row["id"])
+            for job_id in orphaned:
+                self._db.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+                    " error = 'worker lost', owner = NULL, lease_until = NULL WHERE id = ?",
+                    (self.max_attempts, job_id),
+                )
+            return len(orphaned)
+        return self._transaction(sweep)
+
+    # ------------------------------------------------------------------ polling
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """{"id", "status", "priority", "kind", "attempts", "result", "error", "created", "finished"} or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, priority, kind, attempts, result, error, created, finished, user_id"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["priority"] = "interactive" if job["priority"] == 0 else "bulk"
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.1) -> Optional[Dict[str, Any]]:
+        """Poll until the job is done or failed (or timeout). Returns the job."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in ("done", "failed"):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {p: {"queued": 0, "running": 0, "done": 0, "failed": 0} for p in PRIORITIES}
+            for row in self._db.execute("SELECT priority, status, COUNT(*) AS n FROM jobs GROUP BY priority, status"):
+                name = "interactive" if row["priority"] == 0 else "bulk"
+                counts[name][row["status"]] = row["n"]
+        for name, c in counts.items():
+            depth = c["queued"] + c["running"]
+            c["limit"] = self.limits[name]
+            c["accepting"] = depth < self.limits[name]
+            c["fill"] = round(depth / self.limits[name], 4) if self.limits[name] else 1.0
+        return counts
+
+    def purge(self, older_than: float = 7 * 86400) -> int:
+        """Delete finished jobs older than `older_than` seconds."""
+        cutoff = time.time() - older_than
+        return self._transaction(lambda: self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (cutoff,)
+        ).rowcount)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Grade one claimed job with the matching autograde_* function."""
+    from autograder_simplified import autograde_base64, autograde_file, autograde_text
+    payload = json.loads(job["payload"])
+    user_id = job.get("user_id")
+    if job["kind"] == "text":
+        return autograde_text(payload["content"], payload.get("content_type"), user_id=user_id)
+    if job["kind"] == "file":
+        return autograde_file(job["data"], payload["filename"], user_id=user_id)
+    return autograde_base64(payload["base64"], payload.get("file_type", "text"), user_id=user_id)
+
+
+def _post_callback(url: str, job: Dict[str, Any]):
+    import httpx
+    try:
+        httpx.post(url, json=job, timeout=10)
+    except httpx.HTTPError:
+        pass  # pollers can still fetch the result
+
+
+class WorkerPool:
+    """
+    Threads that claim and run jobs until stop(). Grading is mostly waiting
+    on the model (extraction runs on the extraction worker pool), so threads
+    are enough. reserved_interactive of the workers never take bulk jobs.
+    A heartbeat thread renews the leases of the jobs being run.
+    """
+
+    def __init__(self, queue: JobQueue, workers: int = 4, reserved_interactive: int = 1,
+                 poll_interval: float = 0.2, on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 runner: Callable[[Dict[str, Any]], Dict[str, Any]] = run_job):
+        self.queue = queue
+        self.workers = workers
+        self.reserved_interactive = min(reserved_interactive, max(0, workers - 1))
+        self.poll_interval = poll_interval
+        self.on_done = on_done
+        self.runner = runner
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._running_lock = threading.Lock()
+        # the counters below are bumped from every worker thread
+        self._counter_lock = threading.Lock()
+        self.completed = 0
+        self.errors = 0
+        self.lost = 0
+
+    @classmethod
+    def from_env(cls, queue: JobQueue, **options) -> "WorkerPool":
+        return cls(
+            queue,
+            workers=int(os.getenv("JOB_QUEUE_WORKERS", "4")),
+            reserved_interactive=int(os.getenv("JOB_QUEUE_INTERACTIVE_WORKERS", "1")),
+            **options,
+        )
+
+    def start(self) -> "WorkerPool":
+        """Re-queue jobs orphaned by a crash, then start the workers."""
+        self.queue.recover()
+        self._stop.clear()
+        for i in range(self.workers):
+            priorities = ["interactive"] if i < self.reserved_interactive else None
+            thread = threading.Thread(target=self._work, args=(priorities,), daemon=True,
+                                      name=f"grading-worker-{i}")
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True, name="grading-heartbeat")
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        return self
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._running_lock:
+                running = list(self._running)
+            self.queue.renew(running)
+
+    def _work(self, priorities: Optional[List[str]]):
+        last_sweep = time.monotonic()
+        while not self._stop.is_set():
+            job = self.queue.claim(priorities)
+            if job is None:
+                if time.monotonic() - last_sweep > self.queue.lease_seconds / 4:
+                    self.queue.recover()
+                    last_sweep = time.monotonic()
+                self._stop.wait(self.poll_interval)
+                continue
+            with self._running_lock:
+                self._running.add(job["id"])
+            try:
+                result = self.runner(job)
+            except Exception as e:
+                self._count("errors")
+                owned = self.queue.fail(job["id"], f"{type(e).__name__}: {e}")
+            else:
+                owned = self.queue.complete(job["id"], result)
+                if owned:
+                    self._count("completed")
+            finally:
+                with self._running_lock:
+                    self._running.discard(job["id"])
+            if not owned:
+                self._count("lost")  # the lease was lost and the job re-run elsewhere: that run reports it
+                continue
+            finished = self.queue.get(job["id"])
+            if finished and finished["status"] in ("done", "failed"):
+                if self.on_done:
+                    self.on_done(finished)
+                if job.get("callback_url"):
+                    _post_callback(job["callback_url"], finished)
+
+    def _count(self, name: str):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop claiming; running jobs finish first (unfinished ones are recovered on restart)."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
@@ -1,5 +1,7 @@
 # main.py
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from instrumentation import PROMETHEUS_CONTENT_TYPE, render_metrics
 from routers import token_routes, autograder_routes
 
 app = FastAPI(title="Edu Platform (No-SQL) – Token Tracking & Autograder")
@@ -10,3 +12,8 @@ app.include_router(autograder_routes.router)
 @app.get("/")
 def root():
     return {"message": "Token tracking & autograder is up ✨"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Per-stage grading latency histograms (AUTOGRADER_METRICS=1, see instrumentation.py)
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
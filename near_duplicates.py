@@ -0,0 +1,306 @@
+# near_duplicates.py
+# Near-duplicate index of graded submissions (MinHash + LSH).
+# The grading cache only catches byte-identical resubmissions; this catches
+# the ones that differ by renamed variables, comments, whitespace or a few
+# edited words. Text is normalized (normalize_code / normalize_prose), cut
+# into shingles and summarized as a one-permutation MinHash signature; LSH
+# banding then finds candidates with a handful of indexed lookups, so a query
+# costs the same against 100 or 500,000 indexed submissions. Candidates are
+# verified on the full signature before a match is returned.
+#
+# Index rows live in SQLite. When enabled, the index is a file next to the
+# grading cache's disk tier (or next to this module), so every worker shares
+# it and it outlives restarts; while "off" nothing is written. The shared
+# index is opened on first use by near_duplicate_index(), not at import.
+#
+# Environment:
+#   NEAR_DUPLICATES           "off" (default), "flag" (grade, but mark near
+#                             duplicates for instructor review) or "reuse"
+#                             (return the earlier feedback without a model call)
+#   NEAR_DUPLICATE_THRESHOLD  estimated Jaccard similarity for a match (default 0.9)
+#   NEAR_DUPLICATE_DIR        keep the index in this directory (near_duplicates.db;
+#                             default GRADING_CACHE_DIR, else this module's directory)
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from instrumentation import timed
+
+NUM_HASHES = 128
+BANDS = 16                     # 16 bands x 8 rows: candidate above ~0.7 similarity
+ROWS = NUM_HASHES // BANDS
+CODE_SHINGLE = 5               # tokens per shingle
+PROSE_SHINGLE = 3              # words per shingle
+MIN_SHINGLES = 8               # shorter texts are too short to call near duplicates
+MAX_CANDIDATES = 64            # verified per query, most band collisions first
+
+_EMPTY = (1 << 64) - 1
+_MASK32 = 0xFFFFFFFF
+
+# Kept verbatim by normalize_code; every other identifier becomes "v"
+_CODE_KEYWORDS = frozenset("""
+    and as assert async await break case catch class const continue def default del do elif else
+    enum except export extends false final finally for from function global if implements import
+    in instanceof interface is lambda let new none nonlocal not null or pass private protected
+    public raise return self static struct super switch this throw throws true try typeof var
+    void while with yield
+    bool boolean byte char double float int long short string str list dict set tuple
+    print println printf input len range append cout cin endl std system out console log main
+    math sqrt abs min max sum sorted open
+""".split())
+
+_CODE_COMMENT = re.compile(r"/\*.*?\*/|//[^\n]*|#[^\n]*", re.S)
+_CODE_TOKEN = re.compile(r"\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'|[A-Za-z_]\w*|\d+(?:\.\d+)?|[^\s\w]")
+_WORD = re.compile(r"[^\W_]+")
+
+
+def normalize_code(text: str) -> List[str]:
+    """
+    Token stream that ignores naming and layout: comments dropped, string
+    literals -> "s", identifiers (other than keywords and common builtins) -> "v".
+    """
+    tokens = []
+    for token in _CODE_TOKEN.findall(_CODE_COMMENT.sub(" ", text or "")):
+        if token[0] in "\"'":
+            tokens.append("s")
+        elif token[0].isalpha() or token[0] == "_":
+            lowered = token.lower()
+            tokens.append(lowered if lowered in _CODE_KEYWORDS else "v")
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def normalize_prose(text: str) -> List[str]:
+    """Words only: NFKC, case-folded, punctuation and layout dropped."""
+    return _WORD.findall(unicodedata.normalize("NFKC", text or "").casefold())
+
+
+def shingles(text: str, content_type: str) -> List[str]:
+    """Overlapping token n-grams of the normalized text (code or prose normalizer by content type)."""
+    if content_type == "code":
+        tokens, size = normalize_code(text), CODE_SHINGLE
+    else:
+        tokens, size = normalize_prose(text), PROSE_SHINGLE
+    return [" ".join(tokens[i:i + size]) for i in range(max(1, len(tokens) - size + 1))] if tokens else []
+
+
+def minhash(features: List[str], num_hashes: int = NUM_HASHES) -> array:
+    """
+    One-permutation MinHash: each feature is hashed once into one of
+    num_hashes bins (the bin keeps its minimum); empty bins borrow the next
+    non-empty bin's value, offset by the distance. One hash per feature
+    instead of num_hashes, with the same collision probability.
+    """
+    bins = [_EMPTY] * num_hashes
+    for feature in set(features):
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        b = h % num_hashes
+        value = h // num_hashes
+        if value < bins[b]:
+            bins[b] = value
+    signature = array("I", bytes(4 * num_hashes))
+    filled = [i for i in range(num_hashes) if bins[i] != _EMPTY]
+    if not filled:
+        return signature
+    nxt = filled[0] + num_hashes  # densify: walk right to left, remembering the next filled bin
+    for i in range(num_hashes - 1, -1, -1):
+        if bins[i] != _EMPTY:
+            nxt = i
+            signature[i] = bins[i] & _MASK32
+        else:
+            signature[i] = (bins[nxt % num_hashes] + (nxt - i) * 0x9E3779B1) & _MASK32
+    return signature
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def _buckets(signature: array, scope: str) -> List[int]:
+    # One bucket per band; scope (content type, model, prompt version) is
+    # mixed in so unrelated gradings never share a bucket
+    raw = signature.tobytes()
+    width = 4 * ROWS
+    return [
+        int.from_bytes(hashlib.blake2b(raw[band * width:(band + 1) * width], digest_size=8,
+                                       person=band.to_bytes(2, "little"),
+                                       key=scope.encode("utf-8")[:64]).digest(), "little", signed=True)
+        for band in range(BANDS)
+    ]
+
+
+class NearMatch(NamedTuple):
+    key: str                 # the earlier submission's key (the grading cache key, in the autograder)
+    similarity: float
+    result: Dict[str, Any]   # its stored grading result
+
+
+class NearDuplicateIndex:
+    def __init__(self, path: str = ":memory:", threshold: float = 0.9, action: str = "off"):
+        self.path = path
+        self.threshold = threshold
+        self.action = action
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            " id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, scope TEXT NOT NULL,"
+            " signature BLOB NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " bucket INTEGER NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (bucket, id)) WITHOUT ROWID"
+        )
+        self.queries = 0
+        self.matches = 0
+        self.added = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_env(cls) -> "NearDuplicateIndex":
+        action = os.getenv("NEAR_DUPLICATES", "off")
+        path = ":memory:"
+        if action != "off":
+            directory = (os.getenv("NEAR_DUPLICATE_DIR") or os.getenv("GRADING_CACHE_DIR")
+                         or os.path.dirname(os.path.abspath(__file__)))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "near_duplicates.db")
+        return cls(
+            path=path,
+            threshold=float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9")),
+            action=action,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.action in ("flag", "reuse")
+
+    def signature(self, text: str, content_type: str) -> Optional[array]:
+        """MinHash signature of `text`, or None if it is too short to compare."""
+        features = shingles(text, content_type)
+        if len(features) < MIN_SHINGLES:
+            return None
+        return minhash(features)
+
+    def _best(self, signature: array, scope: str, threshold: float) -> Optional[NearMatch]:
+        buckets = _buckets(signature, scope)
+        rows = self._db.execute(
+            "SELECT s.key, s.signature, s.result FROM submissions s JOIN"
+            " (SELECT id, COUNT(*) AS hits FROM buckets WHERE bucket IN (%s)"
+            "  GROUP BY id ORDER BY hits DESC LIMIT ?) c ON c.id = s.id"
+            " WHERE s.scope = ?" % ",".join("?" * len(buckets)),
+            (*buckets, MAX_CANDIDATES, scope),
+        ).fetchall()
+        best = None
+        for key, blob, result in rows:
+            score = similarity(signature, array("I", blob))
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score, result)
+        return NearMatch(best[0], best[1], json.loads(best[2])) if best else None
+
+    @timed("near_duplicates.query")
+    def query(self, text: str, content_type: str, scope: str = "",
+              threshold: Optional[float] = None) -> Optional[NearMatch]:
+        """The most similar indexed submission at or above the threshold, if any."""
+        signature = self.signature(text, content_type)
+        if signature is None:
+            return None
+        scope = f"{content_type}\0{scope}"
+        with self._lock:
+            self.queries += 1
+            match = self._best(signature, scope, self.threshold if threshold is None else threshold)
+            if match:
+                self.matches += 1
+            return match
+
+    @timed("near_duplicates.add")
+    def add(self, key: str, text: str, content_type: str, result: Dict[str, Any], scope: str = "") -> bool:
+        """
+        Index a graded submission under `key`. Texts that are too short, or
+        that an indexed submission already matches exactly, are skipped (the
+        earlier one answers for both). Returns True if it was added.
+        """
+        signature = self.signature(text, content_type)
+        if signature is None:
+            return False
+        scope = f"{content_type}\0{scope}"
+        with self._lock:
+            if self._best(signature, scope, 1.0):
+                self.skipped += 1
+                return False
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO submissions (key, scope, signature, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, scope, signature.tobytes(), json.dumps(result, ensure_ascii=False), time.time()),
+                )
+                added = cursor.rowcount > 0
+                if added:
+                    self._db.executemany("INSERT OR IGNORE INTO buckets (bucket, id) VALUES (?, ?)",
+                                         [(bucket, cursor.lastrowid) for bucket in _buckets(signature, scope)])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            if added:
+                self.added += 1
+            return added
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM buckets")
+            self._db.execute("DELETE FROM submissions")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "action": self.action,
+                "threshold": self.threshold,
+                "queries": self.queries,
+                "matches": self.matches,
+                "added": self.added,
+                "skipped": self.skipped,
+                "entries": self._db.execute("SELECT COUNT(*) FROM submissions").fetchone()[0],
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def near_duplicate_index() -> NearDuplicateIndex:
+    """The shared index (configured from the environment on first use)."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex.from_env()
+    return _index
+
+
+def set_near_duplicate_index(index: Optional[NearDuplicateIndex]):
+    """Replace the shared index (None: reopen from the environment on next use)."""
+    global _index
+    with _index_lock:
+        _index = index
@@ -0,0 +1,64 @@
+# pricing.py
+# Per-model prices, in USD per 1K tokens, for cost accounting and pre-flight
+# cost estimates. Dated snapshots ("gpt-4o-2024-08-06") are priced as their
+# base model (longest matching prefix); unknown models fall back to
+# DEFAULT_PRICE_MODEL's price.
+#
+# Environment:
+#   MODEL_PRICES       JSON {"model": [input_per_1k, output_per_1k], ...} merged over the table
+#   MODEL_PRICES_FILE  path to a JSON file in the same format
+
+import json
+import os
+from typing import Dict, NamedTuple, Optional
+
+
+class ModelPrice(NamedTuple):
+    input_per_1k: float
+    output_per_1k: float
+
+
+DEFAULT_PRICE_MODEL = "gpt-4o"
+
+PRICES: Dict[str, ModelPrice] = {
+    "gpt-4o": ModelPrice(0.005, 0.015),
+    "gpt-4o-mini": ModelPrice(0.00015, 0.0006),
+    "gpt-4.1": ModelPrice(0.002, 0.008),
+    "gpt-4.1-mini": ModelPrice(0.0004, 0.0016),
+    "gpt-4.1-nano": ModelPrice(0.0001, 0.0004),
+    "gpt-4-turbo": ModelPrice(0.01, 0.03),
+    "gpt-3.5-turbo": ModelPrice(0.0005, 0.0015),
+}
+
+
+def _load_overrides():
+    overrides = {}
+    path = os.getenv("MODEL_PRICES_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides.update(json.load(f))
+    if os.getenv("MODEL_PRICES"):
+        overrides.update(json.loads(os.environ["MODEL_PRICES"]))
+    for model, (input_per_1k, output_per_1k) in overrides.items():
+        PRICES[model] = ModelPrice(float(input_per_1k), float(output_per_1k))
+
+
+_load_overrides()
+
+
+def set_price(model: str, input_per_1k: float, output_per_1k: float):
+    PRICES[model] = ModelPrice(float(input_per_1k), float(output_per_1k))
+
+
+def price_for(model: Optional[str]) -> ModelPrice:
+    """Price of `model`: exact entry, else the longest prefix entry, else the default model's."""
+    if model in PRICES:
+        return PRICES[model]
+    matches = [name for name in PRICES if model and model.startswith(name)]
+    return PRICES[max(matches, key=len)] if matches else PRICES[DEFAULT_PRICE_MODEL]
+
+
+def completion_cost(prompt_tokens: int, completion_tokens: int, model: Optional[str] = None) -> float:
+    """USD cost of one call (unrounded)."""
+    price = price_for(model or DEFAULT_PRICE_MODEL)
+    return (prompt_tokens * price.input_per_1k + completion_tokens * price.output_per_1k) / 1000
@@ -0,0 +1,224 @@
+# rate_limiter.py
+# Requests-per-minute and tokens-per-minute token buckets in front of every
+# model call, so a fleet of workers stays under the OpenAI account limits
+# instead of bursting into waves of 429s.
+#
+# A call takes one request and its estimated tokens (prompt + max completion,
+# which is how OpenAI counts against TPM). When either bucket is short the
+# caller waits (queues) until the buckets refill; it never fails unless a
+# timeout is given. With RATE_LIMIT_DB the bucket levels live in a SQLite
+# file, so every process on the host draws from the same budget; otherwise
+# they are per process. Waiters are not served strictly first-come.
+#
+# Environment:
+#   OPENAI_RPM          requests per minute (default 0 = no limit)
+#   OPENAI_TPM          tokens per minute (default 0 = no limit)
+#   RATE_LIMIT_DB       SQLite file shared by all processes (default: per-process buckets)
+#   RATE_LIMIT_BURST    bucket size, in seconds of refill (default 60)
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class RateLimitTimeout(TimeoutError):
+    pass
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0, db_path: Optional[str] = None,
+                 name: str = "openai", burst_seconds: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.name = name
+        self.request_capacity = max(1.0, rpm * burst_seconds / 60)
+        self.token_capacity = max(1.0, tpm * burst_seconds / 60)
+        self._lock = threading.Lock()
+        self._levels = None  # in-process buckets: (requests, tokens, updated)
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " name TEXT PRIMARY KEY, requests REAL NOT NULL,"
+                " tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.waiting = 0
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls(
+            rpm=float(os.getenv("OPENAI_RPM", "0")),
+            tpm=float(os.getenv("OPENAI_TPM", "0")),
+            db_path=os.getenv("RATE_LIMIT_DB") or None,
+            burst_seconds=float(os.getenv("RATE_LIMIT_BURST", "60")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rpm or self.tpm)
+
+    def _refilled(self, levels: Optional[Tuple[float, float, float]], now: float) -> Tuple[float, float]:
+        if levels is None:
+            return self.request_capacity, self.token_capacity
+        requests, tokens, updated = levels
+        elapsed = max(0.0, now - updated)
+        return (min(self.request_capacity, requests + elapsed * self.rpm / 60),
+                min(self.token_capacity, tokens + elapsed * self.tpm / 60))
+
+    def _wait_for(self, requests: float, tokens: float, wanted: float) -> float:
+        wait = 0.0
+        if self.rpm and requests < 1:
+            wait = (1 - requests) * 60 / self.rpm
+        if self.tpm and tokens < wanted:
+            wait = max(wait, (wanted - tokens) * 60 / self.tpm)
+        return wait
+
+    def _take(self, wanted: float) -> float:
+        """Take one request + `wanted` tokens if both are there; else return seconds to wait."""
+        wanted = min(wanted, self.token_capacity)  # a huge call must still fit an empty bucket
+        with self._lock:
+            now = time.time()
+            if self._db is None:
+                requests, tokens = self._refilled(self._levels, now)
+                wait = self._wait_for(requests, tokens, wanted)
+                if not wait:
+                    requests, tokens = requests - 1, tokens - wanted
+                self._levels = (requests, tokens, now)
+                return wait
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT requests, tokens, updated FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                requests, tokens = self._refilled(row, now)
+                wait = self._wait_for(requests, tokens, wanted)
+                if not wait:
+                    requests, tokens = requests - 1, tokens - wanted
+                self._db.execute(
+                    "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated) VALUES (?, ?, ?, ?)",
+                    (self.name, requests, tokens, now),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return wait
+
+    def _record(self, waited: float):
+        with self._lock:
+            self.acquired += 1
+            if waited:
+                self.waited += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def _next_wait(self, tokens: float, began: float, timeout: Optional[float]) -> float:
+        wait = self._take(tokens)
+        if wait and timeout is not None and time.monotonic() - began + wait > timeout:
+            raise RateLimitTimeout(f"rate limit: no capacity for {tokens:.0f} tokens within {timeout}s")
+        # jitter so waiters in other processes don't all retry at the same instant
+        return wait and wait + random.uniform(0, 0.01)
+
+    def acquire(self, tokens: float = 0, timeout: Optional[float] = None) -> float:
+        """Block until one request and `tokens` tokens are available. Returns seconds waited."""
+        if not self.enabled:
+            return 0.0
+        began = time.monotonic()
+        slept = False
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                wait = self._next_wait(tokens, began, timeout)
+                if not wait:
+                    break
+                slept = True
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        waited = time.monotonic() - began if slept else 0.0
+        self._record(waited)
+        return waited
+
+    async def acquire_async(self, tokens: float = 0, timeout: Optional[float] = None) -> float:
+        """acquire() for event loops: waits with asyncio.sleep."""
+        if not self.enabled:
+            return 0.0
+        began = time.monotonic()
+        slept = False
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                if self._db is None:
+                    wait = self._next_wait(tokens, began, timeout)
+                else:
+                    wait = await asyncio.to_thread(self._next_wait, tokens, began, timeout)
+                if not wait:
+                    break
+                slept = True
+                await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        waited = time.monotonic() - began if slept else 0.0
+        self._record(waited)
+        return waited
+
+    def state(self) -> Dict[str, Any]:
+        """Bucket levels (shared ones if RATE_LIMIT_DB is set) and this process's waits."""
+        with self._lock:
+            if self._db is None:
+                levels = self._levels
+            else:
+                levels = self._db.execute(
+                    "SELECT requests, tokens, updated FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+            requests, tokens = self._refilled(levels, time.time())
+            return {
+                "enabled": self.enabled,
+                "shared": self._db is not None,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "requests_available": round(requests, 3),
+                "tokens_available": round(tokens, 1),
+                "request_utilization": round(1 - requests / self.request_capacity, 4) if self.rpm else 0.0,
+                "token_utilization": round(1 - tokens / self.token_capacity, 4) if self.tpm else 0.0,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "max_wait": round(self.max_wait, 3),
+                "waiting": self.waiting,
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def model_rate_limiter() -> RateLimiter:
+    """The limiter every model call goes through (configured from the environment)."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter.from_env()
+    return _limiter
+
+
+def set_model_rate_limiter(limiter: Optional[RateLimiter]):
+    """Replace the shared limiter (None: rebuild from the environment on next use)."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
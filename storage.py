@@ -1,68 +1,845 @@
 # storage.py
-import json, os, threading
+# Pluggable storage for users and usage logs. Pick a backend with
+# STORAGE_BACKEND:
+#
+#   json   (default) log-structured JSON files next to tokens.json:
+#            tokens.users.json   - snapshot of all user records
+#            tokens.users.jsonl  - delta journal of user changes since the snapshot
+#            tokens.logs.jsonl   - append-only usage log rows
+#          Everything is kept in memory; writes append one line. An OS-level
+#          lock on tokens.lock serialises writers across processes, and each
+#          process catches up on lines other processes appended. A usage
+#          record is committed by one journal line carrying both the new
+#          token_used and the log row; the log file append follows, and is
+#          redone on the next open if a crash came in between. Quota
+#          reservations are journal entries too, re-written after compaction.
+#   sqlite tokens.db in WAL mode with indexed users/logs/reservations tables
+#          (path override: STORAGE_SQLITE_PATH).
+#
+# Both are safe with several uvicorn workers, and reservations are shared by
+# all of them. A hold expires after STORAGE_RESERVATION_TTL seconds, so one
+# left behind by a crashed worker stops blocking quota. A legacy tokens.json
+# is migrated on first open.
+import json, os, sqlite3, threading, time, uuid
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from contextlib import contextmanager
 from datetime import datetime
 
+from instrumentation import timed
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 _DB_PATH = os.path.join(os.path.dirname(__file__), "tokens.json")
-_LOCK = threading.Lock()
+_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH")
+# Reentrant: backends take it internally and module helpers may nest calls
+_LOCK = threading.RLock()
+
+# Fold the user journal into the snapshot after this many entries
+_COMPACT_EVERY = int(os.getenv("STORAGE_COMPACT_EVERY", "1000"))
+# fsync every append (slower, survives power loss rather than just crashes)
+_FSYNC = os.getenv("STORAGE_FSYNC", "0") == "1"
+# Seconds a reservation holds quota before it counts as abandoned
+_RESERVATION_TTL = float(os.getenv("STORAGE_RESERVATION_TTL", "600"))
+
+_USER_DEFAULTS = {"name": "User", "role": "student", "token_limit": 100000, "token_used": 0}
 
-def _load():
-    if not os.path.exists(_DB_PATH):
-        return {"users": {}, "logs": []}
-    with open(_DB_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+_store = None
 
-def _save(data):
-    tmp = _DB_PATH + ".tmp"
+
+def _paths(db_path):
+    base, _ = os.path.splitext(db_path)
+    return {
+        "snapshot": base + ".users.json",
+        "journal": base + ".users.jsonl",
+        "logs": base + ".logs.jsonl",
+        "lock": base + ".lock",
+    }
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2, default=str)
-    os.replace(tmp, _DB_PATH)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
-def ensure_user(user_id: str, name="User", role="student", token_limit=100000):
+
+def _read_jsonl(path, offset=0, repair=True):
+    """
+    Read records appended to a JSONL file after byte `offset`.
+    A torn trailing line (writer crashed mid-append) is truncated away,
+    or just skipped when repair is False.
+    Returns: (records, new_offset)
+    """
+    if not os.path.exists(path):
+        return [], 0
+    records = []
+    good = offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            good += len(line)
+            if line.strip():
+                records.append(json.loads(line))
+    if repair and good != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good)
+    return records, good
+
+
+def _read_json_store(db_path):
+    """
+    Users and logs of a JSON store (legacy or log-structured), read without
+    migrating or repairing anything on disk.
+    Returns: (users, logs)
+    """
+    paths = _paths(db_path)
+    if not os.path.exists(paths["snapshot"]):
+        with open(db_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        return legacy.get("users", {}), legacy.get("logs", [])
+    with open(paths["snapshot"], "r", encoding="utf-8") as f:
+        users = json.load(f)
+    entries, _ = _read_jsonl(paths["journal"], repair=False)
+    for entry in entries:
+        if "fields" in entry:
+            users.setdefault(entry["id"], {}).update(entry["fields"])
+    logs, _ = _read_jsonl(paths["logs"], repair=False)
+    for entry in entries:
+        log = entry.get("log")
+        if log is not None and log["id"] == len(logs) + 1:
+            logs.append(log)
+    return users, logs
+
+
+def _log_row(user_id, request_type, model, tokens_used, cost_usd):
+    return {
+        "user_id": user_id,
+        "request_type": request_type,
+        "model": model,
+        "tokens_used": tokens_used,
+        "cost_usd": cost_usd,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class _FileLock:
+    """Reentrant exclusive OS-level lock on a file (flock / msvcrt.locking)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            if self.fh is None:
+                self.fh = open(self.path, "a+b")
+            if fcntl:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+            else:
+                self.fh.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self.fh.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue  # LK_LOCK gives up after ~10s; keep waiting
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+            else:
+                self.fh.seek(0)
+                msvcrt.locking(self.fh.fileno(), msvcrt.LK_UNLCK, 1)
+        return False
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+# ============================================================================
+# BACKEND INTERFACE
+# ============================================================================
+
+class StorageBackend(ABC):
+    """
+    What every storage backend implements. Records go in and come out as
+    plain dicts; returned dicts must be copies the caller may mutate.
+    """
+
+    @abstractmethod
+    def ensure_user(self, user_id, fields):
+        """Create the user with fields unless it exists; return the user."""
+
+    @abstractmethod
+    def get_user(self, user_id):
+        """The user record, or None."""
+
+    @abstractmethod
+    def update_user(self, user_id, fields):
+        """Merge fields into an existing user; None if the user doesn't exist."""
+
+    @abstractmethod
+    def add_log(self, row):
+        """Assign the next log id to row, persist it and return it."""
+
+    @abstractmethod
+    def record_usage(self, row, user_defaults, release=None):
+        """
+        Atomically create the user if missing, add row tokens to token_used,
+        add the log and drop the hold `release`.
+        """
+
+    @abstractmethod
+    def record_usage_many(self, rows, user_defaults):
+        """record_usage for many rows in one critical section / transaction."""
+
+    @abstractmethod
+    def scan_logs(self, user_id, since=None, until=None, model=None, cursor=None):
+        """Yield (cursor, log) for a user's matching rows in id order, after cursor."""
+
+    @abstractmethod
+    def reserve(self, user_id, tokens, user_defaults, ttl):
+        """
+        Atomically create the user if missing and hold `tokens` for `ttl`
+        seconds if they fit in the quota left. Returns the hold id, or None.
+        """
+
+    @abstractmethod
+    def release(self, user_id, hold):
+        """Drop a hold; a no-op if it was already released or expired."""
+
+    @abstractmethod
+    def reserved(self, user_id):
+        """Tokens held by the user's unexpired holds."""
+
+    def compact(self):
+        """Optional housekeeping (fold journals, checkpoint the WAL)."""
+
+    def close(self):
+        """Release files and connections."""
+
+
+# ============================================================================
+# JSON FILE BACKEND
+# ============================================================================
+
+class JsonFileBackend(StorageBackend):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.paths = _paths(db_path)
+        self.users = {}
+        self.logs = []
+        # user_id -> ascending row offsets into self.logs
+        self.user_index = {}
+        # user_id -> {hold_id: [tokens, expires_at]}
+        self.holds = {}
+        self.journal_entries = 0
+        # byte offsets already applied, and identity of the snapshot they apply to
+        self.offsets = {"journal": 0, "logs": 0}
+        self.snapshot_id = None
+        self._handles = {}
+        self._flock = _FileLock(self.paths["lock"])
+        with self._locked():
+            pass
+
+    def _migrate(self):
+        with open(self.db_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        tmp = self.paths["logs"] + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for log in legacy.get("logs", []):
+                f.write(json.dumps(log, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp, self.paths["logs"])
+        if os.path.exists(self.paths["journal"]):
+            os.remove(self.paths["journal"])
+        # The snapshot is written last: its presence marks the migration as done
+        _write_json(self.paths["snapshot"], legacy.get("users", {}))
+        os.replace(self.db_path, self.db_path + ".migrated")
+
+    def _snapshot_identity(self):
+        try:
+            st = os.stat(self.paths["snapshot"])
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """Apply whatever other processes wrote since we last looked."""
+        if not os.path.exists(self.paths["snapshot"]) and os.path.exists(self.db_path):
+            self._migrate()
+        snapshot_id = self._snapshot_identity()
+        if snapshot_id != self.snapshot_id:
+            # first open, or someone compacted: reload users from scratch
+            self.users = {}
+            self.holds = {}
+            if snapshot_id is not None:
+                with open(self.paths["snapshot"], "r", encoding="utf-8") as f:
+                    self.users = json.load(f)
+            self.snapshot_id = snapshot_id
+            self.offsets["journal"] = 0
+            self.journal_entries = 0
+        entries, self.offsets["journal"] = _read_jsonl(self.paths["journal"], self.offsets["journal"])
+        for entry in entries:
+            self._apply(entry)
+        self.journal_entries += len(entries)
+        rows, self.offsets["logs"] = _read_jsonl(self.paths["logs"], self.offsets["logs"])
+        for log in rows:
+            self._index_log(log)
+        # Usage committed in the journal whose log row a crash kept out of the log file
+        for entry in entries:
+            log = entry.get("log")
+            if log is not None and log["id"] == len(self.logs) + 1:
+                self._write_log(log)
+
+    @contextmanager
+    def _locked(self):
+        with _LOCK, self._flock:
+            self._refresh()
+            yield
+
+    def _append(self, name, record):
+        fh = self._handles.get(name)
+        if fh is None:
+            fh = self._handles[name] = open(self.paths[name], "ab")
+        fh.write((json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+        fh.flush()
+        if _FSYNC:
+            os.fsync(fh.fileno())
+        # we were caught up before writing, so the file end is ours
+        self.offsets[name] = fh.tell()
+
+    def _apply(self, entry):
+        if "fields" in entry:
+            self.users.setdefault(entry["id"], {}).update(entry["fields"])
+        if "holds" in entry:
+            if entry["holds"]:
+                self.holds[entry["id"]] = entry["holds"]
+            else:
+                self.holds.pop(entry["id"], None)
+
+    def _put_user(self, user_id, fields, log=None, holds=None):
+        # fields and/or the user's full hold map, in one journal line
+        entry = {"id": user_id}
+        if fields:
+            entry["fields"] = fields
+        if log is not None:
+            entry["log"] = log
+        if holds is not None:
+            entry["holds"] = holds
+        self._append("journal", entry)
+        self._apply(entry)
+        self.journal_entries += 1
+        return self.users.get(user_id)
+
+    def _live_holds(self, user_id, now):
+        return {hold: value for hold, value in self.holds.get(user_id, {}).items() if value[1] > now}
+
+    def _maybe_compact(self):
+        if self.journal_entries >= _COMPACT_EVERY:
+            self.compact()
+
+    def _index_log(self, log):
+        self.user_index.setdefault(log["user_id"], []).append(len(self.logs))
+        self.logs.append(log)
+
+    def _write_log(self, log):
+        self._append("logs", log)
+        self._index_log(log)
+
+    def _append_log(self, row):
+        log = {"id": len(self.logs) + 1, **row}
+        self._write_log(log)
+        return log
+
+    def _ensure(self, user_id, fields):
+        if user_id not in self.users:
+            self._put_user(user_id, {"id": user_id, **fields})
+            self._maybe_compact()
+        return self.users[user_id]
+
+    def ensure_user(self, user_id, fields):
+        with self._locked():
+            return dict(self._ensure(user_id, fields))
+
+    def get_user(self, user_id):
+        with self._locked():
+            user = self.users.get(user_id)
+            return dict(user) if user is not None else None
+
+    def update_user(self, user_id, fields):
+        with self._locked():
+            if user_id not in self.users:
+                return None
+            user = dict(self._put_user(user_id, fields))
+            self._maybe_compact()
+            return user
+
+    def add_log(self, row):
+        with self._locked():
+            return dict(self._append_log(row))
+
+    def _record(self, row, user_defaults, release=None):
+        user = self._ensure(row["user_id"], user_defaults)
+        log = {"id": len(self.logs) + 1, **row}
+        holds = None
+        if release is not None and release in self.holds.get(row["user_id"], {}):
+            holds = self._live_holds(row["user_id"], time.time())
+            holds.pop(release, None)
+        # This one journal line commits the usage (see _refresh for the log file)
+        self._put_user(row["user_id"], {"token_used": int(user["token_used"]) + int(row["tokens_used"])},
+                       log=log, holds=holds)
+        self._write_log(log)
+        self._maybe_compact()
+        return dict(log)
+
+    def record_usage(self, row, user_defaults, release=None):
+        with self._locked():
+            return self._record(row, user_defaults, release)
+
+    def record_usage_many(self, rows, user_defaults):
+        with self._locked():
+            return [self._record(row, user_defaults) for row in rows]
+
+    def scan_logs(self, user_id, since=None, until=None, model=None, cursor=None):
+        since, until = _iso(since), _iso(until)
+        with self._locked():
+            offsets = self.user_index.get(user_id, [])
+            # Rows are append-only, so this prefix stays valid after the lock drops
+            end = len(offsets)
+            logs = self.logs
+        start = bisect_right(offsets, int(cursor), 0, end) if cursor is not None else 0
+        for i in range(start, end):
+            log = logs[offsets[i]]
+            if model is not None and log["model"] != model:
+                continue
+            if since is not None and log["timestamp"] < since:
+                continue
+            if until is not None and log["timestamp"] >= until:
+                continue
+            yield offsets[i], dict(log)
+
+    def reserve(self, user_id, tokens, user_defaults, ttl):
+        with self._locked():
+            user = self._ensure(user_id, user_defaults)
+            now = time.time()
+            holds = self._live_holds(user_id, now)
+            held = sum(value[0] for value in holds.values())
+            if int(user["token_limit"]) - int(user["token_used"]) - held < tokens:
+                return None
+            hold = uuid.uuid4().hex
+            holds[hold] = [tokens, now + ttl]
+            self._put_user(user_id, None, holds=holds)
+            self._maybe_compact()
+            return hold
+
+    def release(self, user_id, hold):
+        with self._locked():
+            if hold not in self.holds.get(user_id, {}):
+                return
+            holds = self._live_holds(user_id, time.time())
+            holds.pop(hold, None)
+            self._put_user(user_id, None, holds=holds)
+            self._maybe_compact()
+
+    def reserved(self, user_id):
+        with self._locked():
+            return sum(value[0] for value in self._live_holds(user_id, time.time()).values())
+
+    def compact(self):
+        with self._locked():
+            # A crash between these two steps only replays idempotent journal entries
+            _write_json(self.paths["snapshot"], self.users)
+            fh = self._handles.pop("journal", None)
+            if fh is not None:
+                fh.close()
+            now = time.time()
+            live = {}
+            for user_id in self.holds:
+                holds = self._live_holds(user_id, now)
+                if holds:
+                    live[user_id] = holds
+            self.holds = live
+            # Holds aren't in the snapshot: the fresh journal starts with the live ones
+            tmp = self.paths["journal"] + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for user_id, holds in self.holds.items():
+                    f.write(json.dumps({"id": user_id, "holds": holds}) + "\n")
+            os.replace(tmp, self.paths["journal"])
+            self.snapshot_id = self._snapshot_identity()
+            self.offsets["journal"] = os.path.getsize(self.paths["journal"])
+            self.journal_entries = len(self.holds)
+
+    def close(self):
+        for fh in self._handles.values():
+            fh.close()
+        self._handles.clear()
+        self._flock.close()
+
+
+# ============================================================================
+# SQLITE BACKEND
+# ============================================================================
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id          TEXT PRIMARY KEY,
+    name        TEXT,
+    role        TEXT,
+    token_limit INTEGER NOT NULL DEFAULT 100000,
+    token_used  INTEGER NOT NULL DEFAULT 0,
+    extra       TEXT
+);
+CREATE TABLE IF NOT EXISTS logs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id      TEXT NOT NULL,
+    request_type TEXT,
+    model        TEXT,
+    tokens_used  INTEGER,
+    cost_usd     REAL,
+    timestamp    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_logs_user ON logs (user_id, id);
+CREATE TABLE IF NOT EXISTS reservations (
+    id         TEXT PRIMARY KEY,
+    user_id    TEXT NOT NULL,
+    tokens     INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_user ON reservations (user_id, expires_at);
+"""
+
+_USER_COLUMNS = ("name", "role", "token_limit", "token_used")
+_LOG_COLUMNS = ("user_id", "request_type", "model", "tokens_used", "cost_usd", "timestamp")
+
+
+class SQLiteBackend(StorageBackend):
+    # rows fetched per round trip while streaming logs
+    SCAN_BATCH = 500
+
+    def __init__(self, sqlite_path, json_path=None):
+        self.path = sqlite_path
+        self.conn = sqlite3.connect(sqlite_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        with _LOCK:
+            self.conn.executescript(_SQLITE_SCHEMA)
+        if json_path:
+            self._import_json(json_path)
+
+    @contextmanager
+    def _tx(self):
+        # IMMEDIATE takes the write lock up front so read-modify-write can't interleave
+        with _LOCK:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _import_json(self, json_path):
+        """One-time import of an existing JSON store (legacy or log-structured)."""
+        paths = _paths(json_path)
+        if not (os.path.exists(json_path) or os.path.exists(paths["snapshot"])):
+            return
+        with self._tx() as conn:
+            if conn.execute("SELECT 1 FROM users UNION ALL SELECT 1 FROM logs LIMIT 1").fetchone():
+                return
+            # Read only: the JSON files stay as they are for whoever still uses them
+            users, logs = _read_json_store(json_path)
+            for user_id, user in users.items():
+                self._insert_user(conn, user_id, user)
+            conn.executemany(
+                "INSERT INTO logs (id, user_id, request_type, model, tokens_used, cost_usd, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ([log["id"]] + [log.get(c) for c in _LOG_COLUMNS] for log in logs),
+            )
+
+    @staticmethod
+    def _insert_user(conn, user_id, fields):
+        fields = {**_USER_DEFAULTS, **fields}
+        extra = {k: v for k, v in fields.items() if k not in _USER_COLUMNS and k != "id"}
+        conn.execute(
+            "INSERT OR IGNORE INTO users (id, name, role, token_limit, token_used, extra) VALUES (?, ?, ?, ?, ?, ?)",
+            [user_id] + [fields[c] for c in _USER_COLUMNS] + [json.dumps(extra, default=str) if extra else None],
+        )
+
+    @staticmethod
+    def _user_dict(row):
+        user = {"id": row["id"], **{c: row[c] for c in _USER_COLUMNS}}
+        if row["extra"]:
+            user.update(json.loads(row["extra"]))
+        return user
+
+    def _fetch_user(self, conn, user_id):
+        row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return self._user_dict(row) if row else None
+
+    def _insert_log(self, conn, row):
+        cur = conn.execute(
+            "INSERT INTO logs (user_id, request_type, model, tokens_used, cost_usd, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            [row[c] for c in _LOG_COLUMNS],
+        )
+        return {"id": cur.lastrowid, **row}
+
+    def ensure_user(self, user_id, fields):
+        with self._tx() as conn:
+            self._insert_user(conn, user_id, fields)
+            return self._fetch_user(conn, user_id)
+
+    def get_user(self, user_id):
+        with _LOCK:
+            return self._fetch_user(self.conn, user_id)
+
+    def update_user(self, user_id, fields):
+        with self._tx() as conn:
+            user = self._fetch_user(conn, user_id)
+            if user is None:
+                return None
+            columns = [c for c in fields if c in _USER_COLUMNS]
+            if columns:
+                conn.execute(
+                    f"UPDATE users SET {', '.join(c + ' = ?' for c in columns)} WHERE id = ?",
+                    [fields[c] for c in columns] + [user_id],
+                )
+            extra = {k: v for k, v in fields.items() if k not in _USER_COLUMNS and k != "id"}
+            if extra:
+                row = conn.execute("SELECT extra FROM users WHERE id = ?", (user_id,)).fetchone()
+                merged = {**json.loads(row["extra"] or "{}"), **extra}
+                conn.execute("UPDATE users SET extra = ? WHERE id = ?", (json.dumps(merged, default=str), user_id))
+            return self._fetch_user(conn, user_id)
+
+    def add_log(self, row):
+        with self._tx() as conn:
+            return self._insert_log(conn, row)
+
+    def _record(self, conn, row, user_defaults, release=None):
+        self._insert_user(conn, row["user_id"], user_defaults)
+        conn.execute(
+            "UPDATE users SET token_used = token_used + ? WHERE id = ?",
+            (int(row["tokens_used"]), row["user_id"]),
+        )
+        if release is not None:
+            conn.execute("DELETE FROM reservations WHERE id = ? AND user_id = ?", (release, row["user_id"]))
+        return self._insert_log(conn, row)
+
+    def record_usage(self, row, user_defaults, release=None):
+        with self._tx() as conn:
+            return self._record(conn, row, user_defaults, release)
+
+    def record_usage_many(self, rows, user_defaults):
+        with self._tx() as conn:
+            return [self._record(conn, row, user_defaults) for row in rows]
+
+    def scan_logs(self, user_id, since=None, until=None, model=None, cursor=None):
+        sql = "SELECT * FROM logs WHERE user_id = ? AND id > ?"
+        filters = []
+        if model is not None:
+            sql += " AND model = ?"
+            filters.append(model)
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            filters.append(_iso(since))
+        if until is not None:
+            sql += " AND timestamp < ?"
+            filters.append(_iso(until))
+        sql += " ORDER BY id LIMIT ?"
+        last = int(cursor) if cursor is not None else 0
+        # keyset batches so the shared connection isn't held while the caller iterates
+        while True:
+            with _LOCK:
+                rows = self.conn.execute(sql, [user_id, last] + filters + [self.SCAN_BATCH]).fetchall()
+            for row in rows:
+                yield row["id"], dict(row)
+            if len(rows) < self.SCAN_BATCH:
+                return
+            last = rows[-1]["id"]
+
+    def reserve(self, user_id, tokens, user_defaults, ttl):
+        with self._tx() as conn:
+            self._insert_user(conn, user_id, user_defaults)
+            now = time.time()
+            conn.execute("DELETE FROM reservations WHERE user_id = ? AND expires_at <= ?", (user_id, now))
+            free = conn.execute(
+                "SELECT token_limit - token_used - (SELECT COALESCE(SUM(tokens), 0) FROM reservations"
+                " WHERE user_id = users.id) FROM users WHERE id = ?",
+                (user_id,),
+            ).fetchone()[0]
+            if free < tokens:
+                return None
+            hold = uuid.uuid4().hex
+            conn.execute("INSERT INTO reservations (id, user_id, tokens, expires_at) VALUES (?, ?, ?, ?)",
+                         (hold, user_id, tokens, now + ttl))
+            return hold
+
+    def release(self, user_id, hold):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM reservations WHERE id = ? AND user_id = ?", (hold, user_id))
+
+    def reserved(self, user_id):
+        with _LOCK:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(tokens), 0) FROM reservations WHERE user_id = ? AND expires_at > ?",
+                (user_id, time.time()),
+            ).fetchone()[0]
+
+    def compact(self):
+        with _LOCK:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.conn.close()
+
+
+# ============================================================================
+# MODULE API
+# ============================================================================
+
+def _db():
+    global _store
+    if _store is None:
+        if _BACKEND == "sqlite":
+            sqlite_path = _SQLITE_PATH or os.path.splitext(_DB_PATH)[0] + ".db"
+            _store = SQLiteBackend(sqlite_path, json_path=_DB_PATH)
+        elif _BACKEND == "json":
+            _store = JsonFileBackend(_DB_PATH)
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {_BACKEND!r} (expected 'json' or 'sqlite')")
+    return _store
+
+
+def open_db(db_path=None, backend=None, sqlite_path=None):
+    """(Re)open the store, optionally at a different path/backend. Mostly for tests/tools."""
+    global _store, _DB_PATH, _BACKEND, _SQLITE_PATH
     with _LOCK:
-        db = _load()
-        users = db["users"]
-        if user_id not in users:
-            users[user_id] = {
-                "id": user_id,
-                "name": name,
-                "role": role,
-                "token_limit": token_limit,
-                "token_used": 0
-            }
-            _save(db)
-        return db["users"][user_id]
+        if _store is not None:
+            _store.close()
+            _store = None
+        if db_path:
+            _DB_PATH = db_path
+            _SQLITE_PATH = sqlite_path
+        if backend:
+            _BACKEND = backend.lower()
+        return _db()
+
+
+@timed("storage.compact")
+def compact():
+    _db().compact()
+
+
+@timed("storage.ensure_user")
+def ensure_user(user_id: str, name="User", role="student", token_limit=100000):
+    return _db().ensure_user(user_id, {
+        "name": name,
+        "role": role,
+        "token_limit": token_limit,
+        "token_used": 0
+    })
 
+@timed("storage.get_user")
 def get_user(user_id: str):
-    with _LOCK:
-        db = _load()
-        return db["users"].get(user_id)
+    return _db().get_user(user_id)
 
+@timed("storage.update_user")
 def update_user(user_id: str, **fields):
-    with _LOCK:
-        db = _load()
-        if user_id not in db["users"]:
-            return None
-        db["users"][user_id].update(fields)
-        _save(db)
-        return db["users"][user_id]
+    return _db().update_user(user_id, fields)
 
+@timed("storage.add_log")
 def add_log(user_id: str, request_type: str, model: str, tokens_used: int, cost_usd: float):
-    with _LOCK:
-        db = _load()
-        log = {
-            "id": len(db["logs"]) + 1,
-            "user_id": user_id,
-            "request_type": request_type,
-            "model": model,
-            "tokens_used": tokens_used,
-            "cost_usd": cost_usd,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        db["logs"].append(log)
-        _save(db)
-        return log
+    return _db().add_log(_log_row(user_id, request_type, model, tokens_used, cost_usd))
 
-def get_logs(user_id: str):
-    with _LOCK:
-        db = _load()
-        return [l for l in db["logs"] if l["user_id"] == user_id]
+@timed("storage.record_usage")
+def record_usage(user_id: str, request_type: str, model: str, tokens_used: int, cost_usd: float, release=None):
+    """
+    Increment a user's token_used and append the usage log in one critical section.
+    Creates the user with defaults if missing. `release` is a hold id from
+    reserve_tokens, given back in the same step.
+    """
+    return _db().record_usage(_log_row(user_id, request_type, model, tokens_used, cost_usd),
+                              dict(_USER_DEFAULTS), release=release)
+
+@timed("storage.record_usage_many")
+def record_usage_many(entries):
+    """
+    Bulk record_usage in a single critical section / transaction.
+    entries: iterable of dicts with user_id, request_type, model, tokens_used, cost_usd
+    """
+    rows = [
+        _log_row(e["user_id"], e["request_type"], e["model"], e["tokens_used"], e["cost_usd"])
+        for e in entries
+    ]
+    return _db().record_usage_many(rows, dict(_USER_DEFAULTS))
+
+@timed("storage.reserve_tokens")
+def reserve_tokens(user_id: str, tokens: int):
+    """
+    Hold `tokens` of the user's remaining quota, across all workers sharing
+    the store, until released or STORAGE_RESERVATION_TTL runs out.
+    Returns the hold id, or None if it doesn't fit.
+    """
+    return _db().reserve(user_id, int(tokens), dict(_USER_DEFAULTS), _RESERVATION_TTL)
+
+def release_tokens(user_id: str, hold: str):
+    _db().release(user_id, hold)
+
+def get_reserved(user_id: str) -> int:
+    return _db().reserved(user_id)
+
+def iter_logs(user_id: str, since=None, until=None, model=None, cursor=None):
+    """
+    Stream a user's log rows without building the full list.
+
+    since/until: ISO timestamp strings or datetimes, half-open [since, until)
+    model: only rows for this model name
+    cursor: resume after a cursor returned by get_logs_page
+    """
+    for _, log in _db().scan_logs(user_id, since, until, model, cursor):
+        yield log
+
+@timed("storage.get_logs_page")
+def get_logs_page(user_id: str, limit=100, cursor=None, since=None, until=None, model=None):
+    """
+    Return one page of a user's log rows.
+    Returns: {"logs": [...], "next_cursor": str or None}
+    Raises ValueError if limit is below 1.
+    """
+    if limit < 1:
+        raise ValueError(f"limit must be at least 1, got {limit}")
+    page = []
+    next_cursor = None
+    last = cursor
+    for position, log in _db().scan_logs(user_id, since, until, model, cursor):
+        if len(page) == limit:
+            next_cursor = str(last)
+            break
+        page.append(log)
+        last = position
+    return {"logs": page, "next_cursor": next_cursor}
+
+def get_logs(user_id: str, since=None, until=None, model=None):
+    return list(iter_logs(user_id, since=since, until=until, model=model))
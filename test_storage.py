@@ -0,0 +1,347 @@
+# test_storage.py
+# Tests for the log-structured storage engine (runs against a temp directory)
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Ensure we can import from current directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import storage
+
+
+LEGACY_DB = {
+    "users": {
+        "student_123": {
+            "id": "student_123",
+            "name": "User",
+            "role": "student",
+            "token_limit": 100000,
+            "token_used": 153
+        }
+    },
+    "logs": [
+        {
+            "id": 1,
+            "user_id": "student_123",
+            "request_type": "autograde",
+            "model": "gpt-4o",
+            "tokens_used": 153,
+            "cost_usd": 0.001325,
+            "timestamp": "2025-10-17T09:50:51.881064"
+        }
+    ]
+}
+
+
+def _fresh_db(legacy=None, backend="json"):
+    path = os.path.join(tempfile.mkdtemp(), "tokens.json")
+    if legacy is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(legacy, f)
+    storage.open_db(path, backend=backend)
+    return path
+
+
+def _record_from_worker(path, backend, count):
+    storage.open_db(path, backend=backend)
+    for _ in range(count):
+        storage.record_usage("shared", "autograde", "gpt-4o", 1, 0.0)
+
+
+def test_legacy_migration():
+    """A legacy tokens.json is migrated on first open"""
+    print("\nTesting legacy tokens.json migration...")
+    path = _fresh_db(LEGACY_DB)
+
+    assert not os.path.exists(path)
+    assert os.path.exists(path + ".migrated")
+    assert storage.get_user("student_123")["token_used"] == 153
+    assert storage.get_logs("student_123")[0]["cost_usd"] == 0.001325
+
+    log = storage.add_log("student_123", "autograde", "gpt-4o", 10, 0.0001)
+    assert log["id"] == 2
+    print("  ✅ Users and logs migrated, log ids continue")
+    return True
+
+
+def test_persistence_and_compaction():
+    """Writes survive a reopen, before and after compaction"""
+    print("\nTesting persistence and compaction...")
+    path = _fresh_db()
+
+    storage.ensure_user("u1", token_limit=500)
+    storage.update_user("u1", token_used=42)
+    storage.add_log("u1", "autograde", "gpt-4o", 42, 0.01)
+    assert storage.update_user("missing", token_used=1) is None
+
+    storage.open_db(path)
+    assert storage.get_user("u1")["token_used"] == 42
+    assert storage.get_user("u1")["token_limit"] == 500
+
+    storage.compact()
+    storage.update_user("u1", token_used=43)
+    storage.open_db(path)
+    assert storage.get_user("u1")["token_used"] == 43
+    assert len(storage.get_logs("u1")) == 1
+    print("  ✅ Snapshot + journal replay restores state")
+    return True
+
+
+def test_torn_append_is_dropped():
+    """A partially written trailing log line is discarded on open"""
+    print("\nTesting torn-write recovery...")
+    path = _fresh_db()
+    storage.ensure_user("u1")
+    storage.add_log("u1", "autograde", "gpt-4o", 5, 0.0)
+
+    logs_path = storage._paths(path)["logs"]
+    storage.open_db(path)
+    storage._db().close()
+    with open(logs_path, "a", encoding="utf-8") as f:
+        f.write('{"id": 2, "user_')
+
+    storage.open_db(path)
+    assert len(storage.get_logs("u1")) == 1
+    assert storage.add_log("u1", "autograde", "gpt-4o", 5, 0.0)["id"] == 2
+    storage.open_db(path)
+    assert len(storage.get_logs("u1")) == 2
+    print("  ✅ Torn trailing line truncated")
+    return True
+
+
+def test_usage_record_survives_crash():
+    """A crash between the journal line and the log append loses neither"""
+    print("\nTesting crash between usage journal and log append...")
+    path = _fresh_db()
+    storage.record_usage("u1", "autograde", "gpt-4o", 5, 0.0)
+    store = storage._db()
+    with store._locked():
+        user = store.users["u1"]
+        log = {"id": len(store.logs) + 1, **storage._log_row("u1", "autograde", "gpt-4o", 7, 0.0)}
+        store._put_user("u1", {"token_used": user["token_used"] + 7}, log=log)
+        # crash: the log row is never appended
+
+    storage.open_db(path)
+    assert storage.get_user("u1")["token_used"] == 12
+    assert [l["tokens_used"] for l in storage.get_logs("u1")] == [5, 7]
+    storage.open_db(path)
+    assert len(storage.get_logs("u1")) == 2
+    print("  ✅ Log row restored from the journal on open")
+    return True
+
+
+def test_returned_records_are_copies():
+    """Callers mutating results must not change stored state"""
+    print("\nTesting returned records are detached...")
+    _fresh_db()
+    user = storage.ensure_user("u1")
+    user["token_used"] = 999
+    assert storage.get_user("u1")["token_used"] == 0
+    print("  ✅ Records are copies")
+    return True
+
+
+def test_indexed_log_queries():
+    """Per-user index with model/time filters, pagination and streaming"""
+    print("\nTesting indexed log queries...")
+    _fresh_db()
+    for i in range(25):
+        storage.add_log("u1", "autograde", "gpt-4o" if i % 2 else "gpt-4o-mini", i, 0.0)
+        storage.add_log("u2", "autograde", "gpt-4o", i, 0.0)
+
+    assert len(storage.get_logs("u1")) == 25
+    assert len(storage.get_logs("u1", model="gpt-4o")) == 12
+    assert storage.get_logs("nobody") == []
+
+    logs = storage.get_logs("u1")
+    since, until = logs[5]["timestamp"], logs[10]["timestamp"]
+    window = storage.get_logs("u1", since=since, until=until)
+    assert all(since <= l["timestamp"] < until for l in window)
+
+    seen, cursor = [], None
+    while True:
+        page = storage.get_logs_page("u1", limit=10, cursor=cursor)
+        seen.extend(l["tokens_used"] for l in page["logs"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == list(range(25))
+    for limit in (0, -1):
+        try:
+            storage.get_logs_page("u1", limit=limit)
+            assert False, "expected a ValueError"
+        except ValueError:
+            pass
+
+    stream = storage.iter_logs("u2")
+    assert next(stream)["tokens_used"] == 0
+    assert sum(1 for _ in stream) == 24
+    print("  ✅ Filters, cursor pages and streaming agree")
+    return True
+
+
+def test_record_usage_is_atomic():
+    """Concurrent usage records never lose an increment"""
+    print("\nTesting concurrent record_usage...")
+    import threading
+    from token_manager import TokenManager
+
+    _fresh_db()
+    TokenManager.bootstrap_user("u1")
+    threads = [
+        threading.Thread(target=lambda: [TokenManager.record_usage("u1", 1, 0.0, "gpt-4o", "autograde") for _ in range(50)])
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert storage.get_user("u1")["token_used"] == 400
+    assert len(storage.get_logs("u1")) == 400
+    print("  ✅ 400/400 increments recorded")
+    return True
+
+
+def test_reserve_commit_release():
+    """Reserved quota is held until committed or released"""
+    print("\nTesting reserve/commit/release...")
+    from token_manager import TokenManager
+
+    _fresh_db()
+    TokenManager.bootstrap_user("u1", token_limit=1000)
+
+    held = TokenManager.reserve("u1", 600)
+    assert held is not None
+    assert TokenManager.remaining_tokens("u1") == 400
+    assert TokenManager.reserve("u1", 500) is None
+
+    held.commit(250, 0.01, "gpt-4o", "autograde")
+    assert TokenManager.remaining_tokens("u1") == 750
+    assert storage.get_logs("u1")[0]["tokens_used"] == 250
+
+    with TokenManager.reserve("u1", 700):
+        assert TokenManager.remaining_tokens("u1") == 50
+    assert TokenManager.remaining_tokens("u1") == 750
+    print("  ✅ Quota held, settled and released")
+    return True
+
+
+def test_reservations_are_shared():
+    """Holds live in the store: other workers see them, compaction keeps them, they expire"""
+    print("\nTesting shared reservations...")
+    for backend in ("json", "sqlite"):
+        path = _fresh_db(backend=backend)
+        storage.ensure_user("u1", token_limit=1000)
+        hold = storage.reserve_tokens("u1", 600)
+        storage.compact()
+        # what another worker process sees
+        other = (storage.JsonFileBackend(path) if backend == "json"
+                 else storage.SQLiteBackend(os.path.splitext(path)[0] + ".db"))
+        assert other.reserved("u1") == 600, backend
+        assert other.reserve("u1", 500, dict(storage._USER_DEFAULTS), 60) is None, backend
+        other.record_usage(storage._log_row("u1", "autograde", "gpt-4o", 100, 0.0),
+                           dict(storage._USER_DEFAULTS), release=hold)
+        assert storage.get_reserved("u1") == 0 and storage.get_user("u1")["token_used"] == 100, backend
+        other.close()
+
+        ttl = storage._RESERVATION_TTL
+        storage._RESERVATION_TTL = 0.05
+        try:
+            assert storage.reserve_tokens("u1", 900) is not None
+        finally:
+            storage._RESERVATION_TTL = ttl
+        assert storage.reserve_tokens("u1", 100) is None
+        time.sleep(0.1)
+        assert storage.get_reserved("u1") == 0 and storage.reserve_tokens("u1", 900) is not None, backend
+        print(f"  ✅ {backend}: holds shared across workers and expired after the TTL")
+    storage.open_db(backend="json")
+    return True
+
+
+def test_multi_process_writers():
+    """Several processes writing the same store never lose updates"""
+    print("\nTesting multi-process writers...")
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    for backend in ("json", "sqlite"):
+        path = _fresh_db(backend=backend)
+        workers = [ctx.Process(target=_record_from_worker, args=(path, backend, 50)) for _ in range(4)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        storage.open_db(path, backend=backend)
+        assert storage.get_user("shared")["token_used"] == 200, backend
+        logs = storage.get_logs("shared")
+        assert len(logs) == 200 and len({l["id"] for l in logs}) == 200, backend
+        print(f"  ✅ {backend}: 200/200 updates from 4 processes")
+    return True
+
+
+def test_sqlite_backend():
+    """SQLite backend imports the JSON store and keeps the same API"""
+    print("\nTesting SQLite backend...")
+    path = _fresh_db(LEGACY_DB)
+    storage.update_user("student_123", nickname="s")
+    storage.open_db(path, backend="sqlite")
+
+    user = storage.get_user("student_123")
+    assert user["token_used"] == 153 and user["nickname"] == "s"
+    assert storage.get_logs("student_123")[0]["id"] == 1
+
+    storage.ensure_user("u1", token_limit=500)
+    assert storage.update_user("u1", token_used=7, nickname="x")["token_used"] == 7
+    assert storage.update_user("missing", token_used=1) is None
+    for i in range(30):
+        storage.add_log("u1", "autograde", "gpt-4o" if i % 2 else "gpt-4o-mini", i, 0.0)
+    assert len(storage.get_logs("u1", model="gpt-4o")) == 15
+
+    page = storage.get_logs_page("u1", limit=20)
+    rest = storage.get_logs_page("u1", limit=20, cursor=page["next_cursor"])
+    assert len(page["logs"]) == 20 and len(rest["logs"]) == 10 and rest["next_cursor"] is None
+
+    storage.open_db(path, backend="json")
+    print("  ✅ Import, filters and pagination work on SQLite")
+
+    legacy = _fresh_db(LEGACY_DB, backend="sqlite")
+    assert storage.get_user("student_123")["token_used"] == 153
+    assert os.path.exists(legacy) and not os.path.exists(storage._paths(legacy)["snapshot"])
+    storage.open_db(legacy, backend="json")
+    print("  ✅ Importing a legacy tokens.json leaves it unmigrated")
+    return True
+
+
+def run_all_tests():
+    tests = [
+        ("Legacy Migration", test_legacy_migration),
+        ("Persistence & Compaction", test_persistence_and_compaction),
+        ("Torn Append", test_torn_append_is_dropped),
+        ("Crash Mid Usage Record", test_usage_record_survives_crash),
+        ("Detached Records", test_returned_records_are_copies),
+        ("Indexed Log Queries", test_indexed_log_queries),
+        ("Atomic Usage Records", test_record_usage_is_atomic),
+        ("Reserve/Commit/Release", test_reserve_commit_release),
+        ("Shared Reservations", test_reservations_are_shared),
+        ("Multi-Process Writers", test_multi_process_writers),
+        ("SQLite Backend", test_sqlite_backend),
+    ]
+    passed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✅ PASS - {name}")
+            passed += 1
+        except AssertionError as e:
+            print(f"❌ FAIL - {name}: {e}")
+    print(f"\nTotal: {passed}/{len(tests)} tests passed")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
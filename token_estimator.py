@@ -0,0 +1,83 @@
+# token_estimator.py
+# Offline token counts for prompts, without a network call.
+# Uses tiktoken when it is installed (exact for OpenAI models); otherwise a
+# BPE-shaped heuristic that tends to slightly overestimate, which is the safe
+# direction for quota reservations and chunk sizing.
+
+import importlib.util
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# tiktoken itself is imported on the first count (it loads BPE tables)
+TIKTOKEN_AVAILABLE = importlib.util.find_spec("tiktoken") is not None
+
+# Chat framing overhead (role markers etc.), as in OpenAI's counting recipe
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Words, numbers, punctuation runs, newline+indentation runs
+_PIECE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]+|\n\s*")
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def _heuristic_tokens(text: str) -> int:
+    # Shaped after BPE vocabularies: common words are one token, long words
+    # ~5 letters per token, digits ~3, punctuation ~2, non-ASCII ~2 bytes
+    tokens = 0
+    for piece in _PIECE.findall(text):
+        if piece[0] == "\n":
+            tokens += 1
+        elif not piece.isascii():
+            tokens += len(piece.encode("utf-8")) // 2 or 1
+        elif piece.isalpha():
+            tokens += 1 if len(piece) <= 7 else -(-len(piece) // 5)
+        elif piece.isdigit():
+            tokens += -(-len(piece) // 3)
+        else:
+            tokens += -(-len(piece) // 2)
+    return tokens
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Tokens in `text` for `model` (tiktoken if available, else an estimate)."""
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE and model:
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    return _heuristic_tokens(text)
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """Prompt tokens for a chat request built from `messages`."""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "", model)
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """
+    Longest prefix of `text` within max_tokens (by count_tokens), cut back to
+    a line break when one is close.
+    """
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = int(len(text) * max_tokens / total)
+    while cut and count_tokens(text[:cut], model) > max_tokens:
+        cut = int(cut * 0.9)
+    newline = text.rfind("\n", 0, cut)
+    if newline > cut * 0.8:
+        cut = newline
+    return text[:cut]
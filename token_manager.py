@@ -1,29 +1,95 @@
 # token_manager.py
-from storage import get_user, ensure_user, update_user, add_log
+from storage import (
+    get_user, ensure_user, update_user,
+    record_usage, record_usage_many, reserve_tokens, release_tokens, get_reserved,
+)
+from instrumentation import timed
+
+
+class Reservation:
+    """
+    Quota held for one in-flight request.
+    Settle it with commit(actual_tokens, ...) or give it back with release().
+    Used as a context manager it is released automatically unless committed.
+    """
+
+    def __init__(self, user_id: str, tokens: int, hold: str):
+        self.user_id = user_id
+        self.tokens = int(tokens)
+        self.hold = hold
+        self.settled = False
+
+    @timed("token_manager.commit")
+    def commit(self, actual_tokens: int, cost: float = 0.0, model: str = "gpt-4o", task: str = "autograde"):
+        if self.settled:
+            return None
+        self.settled = True
+        return record_usage(self.user_id, task, model, int(actual_tokens), float(cost), release=self.hold)
+
+    @timed("token_manager.release")
+    def release(self):
+        if self.settled:
+            return
+        self.settled = True
+        release_tokens(self.user_id, self.hold)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
 
 class TokenManager:
     @staticmethod
     def bootstrap_user(user_id: str, name="User", role="student", token_limit=100000):
         return ensure_user(user_id, name, role, token_limit)
 
+    @staticmethod
+    @timed("token_manager.record_usage")
+    def record_usage(user_id: str, tokens: int, cost: float, model: str, task: str):
+        # counter increment + log append in one critical section;
+        # auto-creates the user with defaults if not present
+        return record_usage(user_id, task, model, int(tokens), float(cost))
+
+    @staticmethod
+    @timed("token_manager.record_usage_bulk")
+    def record_usage_bulk(entries):
+        """
+        Record many usages at once (one lock / transaction).
+        entries: iterable of dicts with user_id, tokens, cost, model, task
+        """
+        return record_usage_many(
+            {
+                "user_id": e["user_id"],
+                "request_type": e["task"],
+                "model": e["model"],
+                "tokens_used": int(e["tokens"]),
+                "cost_usd": float(e["cost"]),
+            }
+            for e in entries
+        )
+
     @staticmethod
     def log_usage(user_id: str, tokens: int, cost: float, model: str, task: str):
-        user = get_user(user_id)
-        if not user:
-            # auto-create with defaults if not present
-            user = TokenManager.bootstrap_user(user_id)
-        # increment usage
-        new_used = int(user["token_used"]) + int(tokens)
-        update_user(user_id, token_used=new_used)
-        # append log
-        return add_log(user_id, task, model, int(tokens), float(cost))
+        return TokenManager.record_usage(user_id, tokens, cost, model, task)
+
+    @staticmethod
+    @timed("token_manager.reserve")
+    def reserve(user_id: str, estimated_tokens: int):
+        """Hold quota before a model call. Returns a Reservation, or None if over quota."""
+        hold = reserve_tokens(user_id, int(estimated_tokens))
+        if hold is None:
+            return None
+        return Reservation(user_id, estimated_tokens, hold)
 
     @staticmethod
     def remaining_tokens(user_id: str):
         user = get_user(user_id)
         if not user:
             return None
-        return int(user["token_limit"]) - int(user["token_used"])
+        return int(user["token_limit"]) - int(user["token_used"]) - get_reserved(user_id)
 
     @staticmethod
     def reset_usage(user_id: str):